@@ -1,11 +1,26 @@
 import streamlit as st
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
 from datetime import datetime
-import json
+import os
 from pathlib import Path
 
+from registry import (
+    COLUMNS,
+    EXPORT_FORMATS,
+    LOCATIONS,
+    LOSS_TYPES,
+    NEEDS_OPTIONS,
+    RECORD_ID_COLUMN,
+    DataManager,
+    ShardedDataManager,
+    dashboard_report,
+    rollup_frame,
+    split_needs,
+    excel_export_available,
+    instrumented,
+    metrics,
+    to_storage_frame
+)
+
 st.set_page_config(
     page_title="سجل صمود العائلات",
     layout="wide",
@@ -163,51 +178,25 @@ def apply_custom_styling():
     </style>
     """, unsafe_allow_html=True)
 
-class DataManager:
-    def __init__(self, filename="families_data.csv"):
-        self.filename = filename
-        self.filepath = Path(filename)
-    
-    def load_data(self):
-        if self.filepath.exists():
-            try:
-                df = pd.read_csv(self.filename, encoding='utf-8-sig')
-                return df
-            except Exception as e:
-                st.error(f"خطأ في تحميل البيانات: {str(e)}")
-                return self._create_empty_dataframe()
-        else:
-            return self._create_empty_dataframe()
-    
-    def _create_empty_dataframe(self):
-        return pd.DataFrame(columns=[
-            'التاريخ',
-            'اسم_العائلة',
-            'عدد_الأفراد',
-            'نوع_الفقد',
-            'الاحتياجات_العاجلة',
-            'الموقع_الجغرافي',
-            'ملاحظات',
-            'رقم_التواصل'
-        ])
-    
-    def save_data(self, df):
-        try:
-            df.to_csv(self.filename, index=False, encoding='utf-8-sig')
-            return True
-        except Exception as e:
-            st.error(f"خطأ في حفظ البيانات: {str(e)}")
-            return False
-    
-    def add_family(self, family_data):
-        df = self.load_data()
-        family_data['التاريخ'] = datetime.now().strftime("%Y-%m-%d %H:%M")
-        df = pd.concat([df, pd.DataFrame([family_data])], ignore_index=True)
-        return self.save_data(df)
-    
-    def export_data(self, df):
-        return df.to_csv(index=False, encoding='utf-8-sig').encode('utf-8-sig')
+def render_save_result(saved):
+    if saved:
+        st.markdown("""
+        <div class='success-message'>
+        تم تسجيل بيانات العائلة بنجاح<br>
+        شكراً لك على توثيق هذه المعلومات المهمة
+        </div>
+        """, unsafe_allow_html=True)
+        st.balloons()
+    else:
+        st.error("حدث خطأ في حفظ البيانات، الرجاء المحاولة مرة أخرى")
+
+def confirm_pending_family(data_manager):
+    st.session_state["pending_family_saved"] = data_manager.submit_family(st.session_state.pop("pending_family"))
 
+def discard_pending_family():
+    st.session_state.pop("pending_family", None)
+
+@instrumented
 def render_data_entry_form(data_manager):
     st.markdown("<h2 style='text-align: center; margin-bottom: 2rem;'>سجل صمود عائلة جديدة</h2>", unsafe_allow_html=True)
     
@@ -240,46 +229,20 @@ def render_data_entry_form(data_manager):
             
             loss_type = st.selectbox(
                 "نوع الفقد أو الضرر *",
-                [
-                    "اختر نوع الفقد",
-                    "فقد أحد أفراد العائلة",
-                    "فقد المنزل بالكامل",
-                    "فقد المنزل جزئياً",
-                    "فقد مصدر الدخل",
-                    "إصابات جسدية",
-                    "نزوح قسري",
-                    "متعدد (فقد وإصابات)"
-                ],
+                ["اختر نوع الفقد"] + LOSS_TYPES,
                 help="حدد نوع الضرر أو الفقد الذي تعرضت له العائلة"
             )
         
         with col2:
             needs = st.multiselect(
                 "الاحتياجات العاجلة *",
-                [
-                    "مأوى مؤقت",
-                    "غذاء ومياه",
-                    "رعاية طبية",
-                    "أدوية",
-                    "ملابس",
-                    "مواد نظافة",
-                    "دعم نفسي",
-                    "مساعدات مالية"
-                ],
+                NEEDS_OPTIONS,
                 help="اختر جميع الاحتياجات العاجلة (يمكن اختيار أكثر من حاجة)"
             )
             
             location = st.selectbox(
                 "الموقع الجغرافي *",
-                [
-                    "اختر المنطقة",
-                    "شمال غزة",
-                    "غزة",
-                    "الوسطى (دير البلح)",
-                    "خان يونس",
-                    "رفح",
-                    "نازح خارج القطاع"
-                ],
+                ["اختر المنطقة"] + LOCATIONS,
                 help="المنطقة التي تتواجد فيها العائلة حالياً"
             )
             
@@ -322,19 +285,249 @@ def render_data_entry_form(data_manager):
                     'رقم_التواصل': contact.strip() if contact else "غير متوفر"
                 }
                 
-                if data_manager.add_family(family_data):
-                    st.markdown("""
-                    <div class='success-message'>
-                    تم تسجيل بيانات العائلة بنجاح<br>
-                    شكراً لك على توثيق هذه المعلومات المهمة
-                    </div>
-                    """, unsafe_allow_html=True)
-                    st.balloons()
+                if data_manager.find_duplicates(family_data).empty:
+                    render_save_result(data_manager.submit_family(family_data))
                 else:
-                    st.error("حدث خطأ في حفظ البيانات، الرجاء المحاولة مرة أخرى")
+                    st.session_state["pending_family"] = family_data
+    
+    if "pending_family_saved" in st.session_state:
+        render_save_result(st.session_state.pop("pending_family_saved"))
+    
+    pending_family = st.session_state.get("pending_family")
+    if pending_family:
+        st.warning(f"قد تكون عائلة {pending_family['اسم_العائلة']} مسجلة مسبقاً، يرجى مراجعة السجلات المشابهة قبل المتابعة")
+        st.dataframe(data_manager.find_duplicates(pending_family), use_container_width=True, hide_index=True)
+        col_confirm, col_cancel = st.columns(2)
+        with col_confirm:
+            st.button(
+                "تسجيل العائلة رغم ذلك",
+                on_click=confirm_pending_family,
+                args=(data_manager,),
+                use_container_width=True
+            )
+        with col_cancel:
+            st.button("إلغاء التسجيل", on_click=discard_pending_family, use_container_width=True)
+
+DASHBOARD_FIGURE_CACHE_SIZE = 32
+
+@instrumented
+def location_figure(report):
+    import plotly.express as px
+    
+    location_counts = report['locations']
+    
+    fig_location = px.bar(
+        x=location_counts.index,
+        y=location_counts.values,
+        labels={'x': 'المنطقة', 'y': 'عدد العائلات'},
+        color=location_counts.values,
+        color_continuous_scale=['#5F9EA0', '#2C3E50'],
+        text=location_counts.values
+    )
+    
+    fig_location.update_layout(
+        showlegend=False,
+        plot_bgcolor='rgba(0,0,0,0)',
+        paper_bgcolor='rgba(0,0,0,0)',
+        font=dict(family="Tajawal", size=12),
+        height=400,
+        xaxis=dict(tickangle=-45)
+    )
+    
+    fig_location.update_traces(
+        texttemplate='%{text}',
+        textposition='outside',
+        marker_line_color='white',
+        marker_line_width=2
+    )
+    return fig_location
+
+@instrumented
+def loss_figure(report):
+    import plotly.express as px
+    
+    loss_counts = report['loss_types']
+    
+    fig_loss = px.pie(
+        values=loss_counts.values,
+        names=loss_counts.index,
+        color_discrete_sequence=px.colors.sequential.Teal,
+        hole=0.4
+    )
+    
+    fig_loss.update_layout(
+        font=dict(family="Tajawal", size=12),
+        height=400,
+        showlegend=True,
+        legend=dict(orientation="v", yanchor="middle", y=0.5)
+    )
+    
+    fig_loss.update_traces(
+        textposition='inside',
+        textinfo='percent+label',
+        marker=dict(line=dict(color='white', width=2))
+    )
+    return fig_loss
 
-def render_analytics_dashboard(df):
-    if df.empty:
+@instrumented
+def needs_figure(report):
+    import plotly.graph_objects as go
+    
+    needs_counts = report['needs']
+    
+    fig_needs = go.Figure(go.Bar(
+        x=needs_counts.values,
+        y=needs_counts.index,
+        orientation='h',
+        marker=dict(
+            color=needs_counts.values,
+            colorscale=[[0, '#5F9EA0'], [0.5, '#E07A5F'], [1, '#2C3E50']],
+            line=dict(color='white', width=2)
+        ),
+        text=needs_counts.values,
+        textposition='outside'
+    ))
+    
+    fig_needs.update_layout(
+        xaxis_title="عدد العائلات",
+        yaxis_title="نوع الحاجة",
+        plot_bgcolor='rgba(0,0,0,0)',
+        paper_bgcolor='rgba(0,0,0,0)',
+        font=dict(family="Tajawal", size=12),
+        height=400,
+        showlegend=False
+    )
+    return fig_needs
+
+@instrumented
+def family_size_figure(report):
+    import plotly.graph_objects as go
+    
+    family_size_bins = report['family_size_bins']
+    fig_family_size = go.Figure(go.Bar(
+        x=family_size_bins.index,
+        y=family_size_bins.values,
+        marker=dict(
+            color='#5F9EA0',
+            line=dict(color='white', width=1.5)
+        )
+    ))
+    
+    fig_family_size.update_layout(
+        plot_bgcolor='rgba(0,0,0,0)',
+        paper_bgcolor='rgba(0,0,0,0)',
+        font=dict(family="Tajawal", size=12),
+        height=350,
+        showlegend=False,
+        bargap=0.1,
+        xaxis=dict(title='عدد الأفراد', type='category'),
+        yaxis_title='عدد العائلات'
+    )
+    return fig_family_size
+
+@instrumented
+def timeline_figure(timeline):
+    import plotly.express as px
+    
+    if timeline.ndim == 1:
+        timeline = timeline.to_frame('عدد العائلات')
+    
+    fig_timeline = px.bar(
+        timeline,
+        labels={'index': 'الفترة', 'value': 'عدد العائلات', 'variable': ''},
+        color_discrete_sequence=['#5F9EA0', '#2C3E50', '#E07A5F', '#81B29A', '#F2CC8F', '#3D405B', '#95A5A6', '#D4A373']
+    )
+    
+    fig_timeline.update_layout(
+        plot_bgcolor='rgba(0,0,0,0)',
+        paper_bgcolor='rgba(0,0,0,0)',
+        font=dict(family="Tajawal", size=12),
+        height=400,
+        barmode='stack',
+        bargap=0.1,
+        showlegend=timeline.shape[1] > 1,
+        legend=dict(orientation="h", yanchor="bottom", y=1.02)
+    )
+    return fig_timeline
+
+DASHBOARD_FIGURES = {
+    'locations': location_figure,
+    'loss_types': loss_figure,
+    'needs': needs_figure,
+    'family_sizes': family_size_figure
+}
+
+@st.cache_resource(max_entries=DASHBOARD_FIGURE_CACHE_SIZE, show_spinner=False)
+def cached_dashboard_figures(filename, data_version, charts, _data_manager):
+    report = dashboard_report(_data_manager.aggregates())
+    return {chart: DASHBOARD_FIGURES[chart](report) for chart in charts}
+
+def dashboard_figures(data_manager, charts=tuple(DASHBOARD_FIGURES)):
+    return cached_dashboard_figures(
+        str(data_manager.filename),
+        data_manager.version(),
+        charts,
+        data_manager
+    )
+
+TIMELINE_GRANULARITIES = {
+    "أسبوعي": 'weekly',
+    "يومي": 'daily',
+    "بالساعة (آخر أسبوعين)": 'hourly'
+}
+
+TIMELINE_DIMENSIONS = {
+    "إجمالي التسجيلات": None,
+    "حسب المنطقة": 'locations',
+    "حسب الاحتياجات": 'needs',
+    "حسب نوع الفقد": 'loss_types'
+}
+
+@st.cache_resource(max_entries=DASHBOARD_FIGURE_CACHE_SIZE, show_spinner=False)
+def cached_timeline_figure(filename, data_version, granularity, dimension, start, end, _data_manager):
+    return timeline_figure(rollup_frame(_data_manager.aggregates(), granularity, dimension, start, end))
+
+@instrumented
+def render_timeline(data_manager):
+    aggregates = data_manager.aggregates()
+    periods = sorted(list(aggregates['daily']) + list(aggregates['hourly']))
+    if not periods:
+        return
+    first_day = datetime.strptime(periods[0][:10], "%Y-%m-%d").date()
+    last_day = datetime.strptime(periods[-1][:10], "%Y-%m-%d").date()
+    
+    st.markdown("### التسجيلات عبر الزمن")
+    
+    col_granularity, col_dimension, col_range = st.columns(3)
+    with col_granularity:
+        granularity = st.selectbox("الفترة الزمنية", list(TIMELINE_GRANULARITIES), key="timeline_granularity")
+    with col_dimension:
+        dimension = st.selectbox("التقسيم", list(TIMELINE_DIMENSIONS), key="timeline_dimension")
+    with col_range:
+        date_range = st.date_input(
+            "نطاق التاريخ",
+            value=(first_day, last_day),
+            min_value=first_day,
+            max_value=last_day,
+            key="timeline_range"
+        )
+    start, end = date_range if len(date_range) == 2 else (first_day, last_day)
+    
+    fig_timeline = cached_timeline_figure(
+        str(data_manager.filename),
+        data_manager.version(),
+        TIMELINE_GRANULARITIES[granularity],
+        TIMELINE_DIMENSIONS[dimension],
+        start.strftime("%Y-%m-%d"),
+        end.strftime("%Y-%m-%d"),
+        data_manager
+    )
+    st.plotly_chart(fig_timeline, use_container_width=True)
+
+@instrumented
+def render_analytics_dashboard(data_manager):
+    summary = data_manager.summary()
+    if summary['families'] == 0:
         st.markdown("""
         <div class='warning-message'>
         لا توجد بيانات لعرضها حالياً<br>
@@ -350,19 +543,19 @@ def render_analytics_dashboard(df):
     with col1:
         st.metric(
             label="إجمالي العائلات المسجلة",
-            value=len(df),
+            value=summary['families'],
             delta=None
         )
     
     with col2:
         st.metric(
             label="إجمالي الأفراد",
-            value=df['عدد_الأفراد'].sum(),
+            value=summary['members'],
             delta=None
         )
     
     with col3:
-        avg_family_size = df['عدد_الأفراد'].mean()
+        avg_family_size = summary['avg_members']
         st.metric(
             label="متوسط أفراد العائلة",
             value=f"{avg_family_size:.1f}",
@@ -370,7 +563,7 @@ def render_analytics_dashboard(df):
         )
     
     with col4:
-        unique_locations = df['الموقع_الجغرافي'].nunique()
+        unique_locations = summary['locations']
         st.metric(
             label="المناطق المتأثرة",
             value=unique_locations,
@@ -379,128 +572,56 @@ def render_analytics_dashboard(df):
     
     st.markdown("<br>", unsafe_allow_html=True)
     
+    figures = dashboard_figures(data_manager)
+    
     col_chart1, col_chart2 = st.columns(2)
     
     with col_chart1:
         st.markdown("### التوزيع الجغرافي للعائلات")
-        location_counts = df['الموقع_الجغرافي'].value_counts()
-        
-        fig_location = px.bar(
-            x=location_counts.index,
-            y=location_counts.values,
-            labels={'x': 'المنطقة', 'y': 'عدد العائلات'},
-            color=location_counts.values,
-            color_continuous_scale=['#5F9EA0', '#2C3E50'],
-            text=location_counts.values
-        )
-        
-        fig_location.update_layout(
-            showlegend=False,
-            plot_bgcolor='rgba(0,0,0,0)',
-            paper_bgcolor='rgba(0,0,0,0)',
-            font=dict(family="Tajawal", size=12),
-            height=400,
-            xaxis=dict(tickangle=-45)
-        )
-        
-        fig_location.update_traces(
-            texttemplate='%{text}',
-            textposition='outside',
-            marker_line_color='white',
-            marker_line_width=2
-        )
-        
-        st.plotly_chart(fig_location, use_container_width=True)
+        st.plotly_chart(figures['locations'], use_container_width=True)
     
     with col_chart2:
         st.markdown("### أنواع الفقد والأضرار")
-        loss_counts = df['نوع_الفقد'].value_counts()
-        
-        fig_loss = px.pie(
-            values=loss_counts.values,
-            names=loss_counts.index,
-            color_discrete_sequence=px.colors.sequential.Teal,
-            hole=0.4
-        )
-        
-        fig_loss.update_layout(
-            font=dict(family="Tajawal", size=12),
-            height=400,
-            showlegend=True,
-            legend=dict(orientation="v", yanchor="middle", y=0.5)
-        )
-        
-        fig_loss.update_traces(
-            textposition='inside',
-            textinfo='percent+label',
-            marker=dict(line=dict(color='white', width=2))
-        )
-        
-        st.plotly_chart(fig_loss, use_container_width=True)
+        st.plotly_chart(figures['loss_types'], use_container_width=True)
     
     st.markdown("### الاحتياجات العاجلة الأكثر طلباً")
-    
-    all_needs = []
-    for needs_str in df['الاحتياجات_العاجلة']:
-        needs_list = [need.strip() for need in needs_str.split(',')]
-        all_needs.extend(needs_list)
-    
-    needs_series = pd.Series(all_needs)
-    needs_counts = needs_series.value_counts()
-    
-    fig_needs = go.Figure(go.Bar(
-        x=needs_counts.values,
-        y=needs_counts.index,
-        orientation='h',
-        marker=dict(
-            color=needs_counts.values,
-            colorscale=[[0, '#5F9EA0'], [0.5, '#E07A5F'], [1, '#2C3E50']],
-            line=dict(color='white', width=2)
-        ),
-        text=needs_counts.values,
-        textposition='outside'
-    ))
-    
-    fig_needs.update_layout(
-        xaxis_title="عدد العائلات",
-        yaxis_title="نوع الحاجة",
-        plot_bgcolor='rgba(0,0,0,0)',
-        paper_bgcolor='rgba(0,0,0,0)',
-        font=dict(family="Tajawal", size=12),
-        height=400,
-        showlegend=False
-    )
-    
-    st.plotly_chart(fig_needs, use_container_width=True)
+    st.plotly_chart(figures['needs'], use_container_width=True)
     
     st.markdown("### توزيع أحجام العائلات")
+    st.plotly_chart(figures['family_sizes'], use_container_width=True)
     
-    fig_family_size = px.histogram(
-        df,
-        x='عدد_الأفراد',
-        nbins=20,
-        labels={'عدد_الأفراد': 'عدد الأفراد', 'count': 'عدد العائلات'},
-        color_discrete_sequence=['#5F9EA0']
-    )
-    
-    fig_family_size.update_layout(
-        plot_bgcolor='rgba(0,0,0,0)',
-        paper_bgcolor='rgba(0,0,0,0)',
-        font=dict(family="Tajawal", size=12),
-        height=350,
-        showlegend=False,
-        bargap=0.1
-    )
-    
-    fig_family_size.update_traces(
-        marker_line_color='white',
-        marker_line_width=1.5
-    )
-    
-    st.plotly_chart(fig_family_size, use_container_width=True)
+    render_timeline(data_manager)
+
+STORIES_PAGE_SIZES = [10, 25, 50, 100]
 
-def render_stories_section(df):
-    if df.empty:
+def reset_stories_page():
+    st.session_state["stories_page"] = 1
+
+def render_story_card(row):
+    return f"""
+    <div class='story-box'>
+        <h4 style='color: #2C3E50; margin-top: 0; font-size: 1.4rem;'>
+            عائلة {row['اسم_العائلة']}
+        </h4>
+        <p style='margin: 0.5rem 0; line-height: 1.8;'>
+            <strong>الموقع:</strong> {row['الموقع_الجغرافي']}<br>
+            <strong>عدد الأفراد:</strong> {row['عدد_الأفراد']} فرداً<br>
+            <strong>نوع الفقد:</strong> {row['نوع_الفقد']}<br>
+            <strong>الاحتياجات:</strong> {row['الاحتياجات_العاجلة']}<br>
+            <strong>التواصل:</strong> {row['رقم_التواصل']}<br>
+            <strong>تاريخ التسجيل:</strong> {row['التاريخ']}
+        </p>
+        <div style='background-color: rgba(255,255,255,0.5); padding: 1rem; border-radius: 8px; margin-top: 1rem;'>
+            <strong style='color: #E07A5F;'>ملاحظات:</strong><br>
+            <em style='color: #2C3E50;'>{row['ملاحظات']}</em>
+        </div>
+    </div>
+    """
+
+@instrumented
+def render_stories_section(data_manager):
+    locations = data_manager.distinct_values('الموقع_الجغرافي')
+    if not locations:
         return
     
     st.markdown("<h2 style='text-align: center; margin-bottom: 2rem;'>القصص خلف الأرقام</h2>", unsafe_allow_html=True)
@@ -514,46 +635,107 @@ def render_stories_section(df):
     </div>
     """, unsafe_allow_html=True)
     
-    st.markdown("#### تصفية حسب المنطقة")
-    selected_location = st.selectbox(
-        "اختر المنطقة",
-        ["جميع المناطق"] + list(df['الموقع_الجغرافي'].unique()),
-        key="location_filter"
+    st.markdown("#### البحث والتصفية")
+    search_text = st.text_input(
+        "ابحث في أسماء العائلات والملاحظات",
+        key="stories_search",
+        on_change=reset_stories_page
     )
     
-    if selected_location != "جميع المناطق":
-        filtered_df = df[df['الموقع_الجغرافي'] == selected_location]
-    else:
-        filtered_df = df
+    col_location, col_loss = st.columns(2)
+    with col_location:
+        selected_locations = st.multiselect(
+            "المناطق",
+            locations,
+            key="location_filter",
+            on_change=reset_stories_page
+        )
+    with col_loss:
+        selected_loss_types = st.multiselect(
+            "نوع الفقد",
+            LOSS_TYPES,
+            key="loss_filter",
+            on_change=reset_stories_page
+        )
+    
+    selected_needs = st.multiselect(
+        "الاحتياجات",
+        NEEDS_OPTIONS,
+        key="needs_filter",
+        on_change=reset_stories_page
+    )
     
-    st.markdown(f"**عدد العائلات: {len(filtered_df)}**")
+    col_members, col_dates = st.columns(2)
+    with col_members:
+        members_range = st.slider(
+            "عدد الأفراد",
+            min_value=1,
+            max_value=50,
+            value=(1, 50),
+            key="members_filter",
+            on_change=reset_stories_page
+        )
+    with col_dates:
+        dates_range = st.date_input(
+            "فترة التسجيل",
+            value=(),
+            key="dates_filter",
+            on_change=reset_stories_page
+        )
+    
+    filters = {
+        'locations': selected_locations,
+        'loss_types': selected_loss_types,
+        'needs': selected_needs,
+        'members': members_range if members_range != (1, 50) else None,
+        'dates': dates_range if len(dates_range) == 2 else None,
+        'text': search_text
+    }
+    total = data_manager.count_search(filters)
+    
+    col_page_size, col_page = st.columns(2)
+    with col_page_size:
+        page_size = st.selectbox(
+            "عدد القصص في الصفحة",
+            STORIES_PAGE_SIZES,
+            key="stories_page_size",
+            on_change=reset_stories_page
+        )
+    
+    page_count = max(1, -(-total // page_size))
+    if st.session_state.get("stories_page", 1) > page_count:
+        st.session_state["stories_page"] = page_count
+    
+    with col_page:
+        page = st.number_input(
+            f"الصفحة (من {page_count})",
+            min_value=1,
+            max_value=page_count,
+            step=1,
+            key="stories_page"
+        )
+    
+    offset = (page - 1) * page_size
+    page_df = data_manager.search_families(filters, offset=offset, limit=page_size)
+    
+    st.markdown(f"**عدد العائلات: {total}** — عرض {offset + 1 if total else 0} إلى {offset + len(page_df)}")
     st.markdown("<br>", unsafe_allow_html=True)
     
-    for idx, row in filtered_df.iterrows():
-        with st.container():
-            st.markdown(f"""
-            <div class='story-box'>
-                <h4 style='color: #2C3E50; margin-top: 0; font-size: 1.4rem;'>
-                    عائلة {row['اسم_العائلة']}
-                </h4>
-                <p style='margin: 0.5rem 0; line-height: 1.8;'>
-                    <strong>الموقع:</strong> {row['الموقع_الجغرافي']}<br>
-                    <strong>عدد الأفراد:</strong> {row['عدد_الأفراد']} فرداً<br>
-                    <strong>نوع الفقد:</strong> {row['نوع_الفقد']}<br>
-                    <strong>الاحتياجات:</strong> {row['الاحتياجات_العاجلة']}<br>
-                    <strong>التواصل:</strong> {row['رقم_التواصل']}<br>
-                    <strong>تاريخ التسجيل:</strong> {row['التاريخ']}
-                </p>
-                <div style='background-color: rgba(255,255,255,0.5); padding: 1rem; border-radius: 8px; margin-top: 1rem;'>
-                    <strong style='color: #E07A5F;'>ملاحظات:</strong><br>
-                    <em style='color: #2C3E50;'>{row['ملاحظات']}</em>
-                </div>
-            </div>
-            """, unsafe_allow_html=True)
-            st.markdown("<br>", unsafe_allow_html=True)
-
-def render_data_table(df, data_manager):
-    if df.empty:
+    st.markdown(
+        "<br>".join(render_story_card(row) for row in to_storage_frame(page_df).to_dict('records')),
+        unsafe_allow_html=True
+    )
+
+@st.fragment(run_every=1)
+def render_export_progress(data_manager, export_format):
+    job = data_manager.exports.job(export_format)
+    if job is None or job.done:
+        st.rerun()
+    st.progress(job.progress, text=f"جارٍ تجهيز الملف... {job.rows_done} من {job.rows_total} عائلة")
+
+@instrumented
+def render_data_table(data_manager):
+    if data_manager.summary()['families'] == 0:
         st.info("لا توجد بيانات لعرضها")
         return
     
@@ -564,8 +746,8 @@ def render_data_table(df, data_manager):
     with col_options1:
         show_columns = st.multiselect(
             "اختر الأعمدة للعرض",
-            options=df.columns.tolist(),
-            default=df.columns.tolist()
+            options=COLUMNS,
+            default=COLUMNS
         )
     
     with col_options2:
@@ -574,7 +756,7 @@ def render_data_table(df, data_manager):
             options=['التاريخ', 'اسم_العائلة', 'عدد_الأفراد', 'الموقع_الجغرافي']
         )
     
-    display_df = df[show_columns].sort_values(by=sort_by, ascending=False)
+    display_df = data_manager.query_families(columns=show_columns, sort_by=sort_by)
     st.dataframe(
         display_df,
         use_container_width=True,
@@ -582,60 +764,218 @@ def render_data_table(df, data_manager):
     )
     
     st.markdown("### تصدير البيانات")
+    export_stamp = datetime.now().strftime('%Y%m%d_%H%M')
     col_export1, col_export2, col_export3 = st.columns(3)
     
-    with col_export1:
-        csv_data = data_manager.export_data(df)
-        st.download_button(
-            label="تحميل CSV",
-            data=csv_data,
-            file_name=f"families_data_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
-            mime="text/csv",
-            use_container_width=True
+    def export_button(label, export_format):
+        artifact = data_manager.exports.artifact(export_format)
+        if artifact is not None:
+            st.download_button(
+                label=label,
+                data=artifact.read_bytes,
+                file_name=f"families_data_{export_stamp}.{EXPORT_FORMATS[export_format]['extension']}",
+                mime=EXPORT_FORMATS[export_format]['mime'],
+                use_container_width=True,
+                key=f"download_{label}"
+            )
+            return
+        
+        job = data_manager.exports.job(export_format)
+        if job is not None and job.error is None:
+            render_export_progress(data_manager, export_format)
+            return
+        if job is not None:
+            st.error(f"تعذر تجهيز الملف: {job.error}")
+        st.button(
+            f"تجهيز ملف {label.removeprefix('تحميل ')}",
+            on_click=data_manager.exports.start,
+            args=(export_format,),
+            use_container_width=True,
+            key=f"prepare_{label}"
         )
     
+    with col_export1:
+        export_button("تحميل CSV", 'csv')
+    
     with col_export2:
-        try:
-            import io
-            excel_buffer = io.BytesIO()
-            
-            try:
-                with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
-                    df.to_excel(writer, index=False, sheet_name='العائلات')
-            except ImportError:
-                with pd.ExcelWriter(excel_buffer, engine='xlsxwriter') as writer:
-                    df.to_excel(writer, index=False, sheet_name='العائلات')
-            
-            excel_data = excel_buffer.getvalue()
-            
-            st.download_button(
-                label="تحميل Excel",
-                data=excel_data,
-                file_name=f"families_data_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                use_container_width=True
+        if excel_export_available():
+            export_button("تحميل Excel", 'xlsx')
+        else:
+            st.warning("تعذر إنشاء ملف Excel\nيرجى استخدام CSV بدلاً منه")
+            export_button("تحميل CSV (بديل)", 'csv')
+    
+    with col_export3:
+        export_button("تحميل JSON", 'json')
+
+def with_current(options, current):
+    return options if current in options or not current else options + [current]
+
+@instrumented
+def render_family_editor(data_manager):
+    st.markdown("<h2 style='text-align: center; margin-bottom: 2rem;'>تعديل أو حذف بيانات عائلة</h2>", unsafe_allow_html=True)
+    
+    query = st.text_input(
+        "ابحث عن العائلة",
+        placeholder="اسم العائلة أو كلمة من الملاحظات",
+        key="editor_search"
+    )
+    if not query.strip():
+        st.info("ابحث باسم العائلة لاختيار السجل المراد تعديله أو حذفه")
+        return
+    
+    matches = data_manager.search_families({'text': query}, limit=50, columns=COLUMNS + [RECORD_ID_COLUMN])
+    if matches.empty:
+        st.warning("لا توجد عائلات مطابقة للبحث")
+        return
+    
+    labels = {
+        row[RECORD_ID_COLUMN]: f"عائلة {row['اسم_العائلة']} — {row['الموقع_الجغرافي']} — {row['عدد_الأفراد']} أفراد"
+        for _, row in matches.iterrows()
+    }
+    record_id = st.selectbox("اختر العائلة", list(labels), format_func=labels.get, key="editor_record")
+    family = data_manager.get_family(record_id)
+    if family is None:
+        return
+    
+    with st.form(f"family_edit_form_{record_id}"):
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            family_name = st.text_input("اسم العائلة *", value=family['اسم_العائلة'] or "")
+            num_members = st.number_input(
+                "عدد أفراد العائلة *",
+                min_value=1,
+                max_value=50,
+                value=min(max(int(family['عدد_الأفراد'] or 1), 1), 50)
+            )
+            loss_types = with_current(LOSS_TYPES, family['نوع_الفقد'])
+            loss_type = st.selectbox(
+                "نوع الفقد أو الضرر *",
+                loss_types,
+                index=loss_types.index(family['نوع_الفقد']) if family['نوع_الفقد'] in loss_types else 0
             )
-        except Exception as e:
-            st.warning(f"تعذر إنشاء ملف Excel: {str(e)}\nيرجى استخدام CSV بدلاً منه")
+        
+        with col2:
+            needs = st.multiselect(
+                "الاحتياجات العاجلة *",
+                NEEDS_OPTIONS,
+                default=[need for need in split_needs(family['الاحتياجات_العاجلة']) if need in NEEDS_OPTIONS]
+            )
+            locations = with_current(LOCATIONS, family['الموقع_الجغرافي'])
+            location = st.selectbox(
+                "الموقع الجغرافي *",
+                locations,
+                index=locations.index(family['الموقع_الجغرافي']) if family['الموقع_الجغرافي'] in locations else 0
+            )
+            contact = st.text_input("رقم التواصل (اختياري)", value=family['رقم_التواصل'] or "")
+        
+        notes = st.text_area("ملاحظات إضافية", value=family['ملاحظات'] or "", height=120)
+        
+        submitted = st.form_submit_button("حفظ التعديلات", use_container_width=True)
+        
+        if submitted:
+            if not family_name.strip():
+                st.error("الرجاء إدخال اسم العائلة")
+            elif not needs:
+                st.error("الرجاء تحديد الاحتياجات العاجلة")
+            elif data_manager.update_family(record_id, {
+                'اسم_العائلة': family_name.strip(),
+                'عدد_الأفراد': num_members,
+                'نوع_الفقد': loss_type,
+                'الاحتياجات_العاجلة': ", ".join(needs),
+                'الموقع_الجغرافي': location,
+                'ملاحظات': notes.strip() if notes else "لا توجد ملاحظات",
+                'رقم_التواصل': contact.strip() if contact else "غير متوفر"
+            }):
+                st.success("تم حفظ التعديلات على بيانات العائلة")
+    
+    st.markdown("---")
+    confirm_delete = st.checkbox("أؤكد حذف سجل هذه العائلة نهائياً", key=f"editor_confirm_delete_{record_id}")
+    if st.button("حذف السجل", disabled=not confirm_delete, use_container_width=True):
+        if data_manager.delete_family(record_id):
+            st.success(f"تم حذف سجل عائلة {family['اسم_العائلة']}")
+
+@instrumented
+def render_bulk_import(data_manager):
+    st.markdown("<h2 style='text-align: center; margin-bottom: 2rem;'>استيراد دفعة من السجلات الميدانية</h2>", unsafe_allow_html=True)
+    
+    st.markdown("""
+    <div class='story-box'>
+    <p style='margin: 0; font-size: 1.05rem;'>
+    ارفع ملف CSV أو Excel بنفس أعمدة ملف التصدير. يتم فحص كل صف بنفس شروط نموذج التسجيل،
+    وتُحفظ الصفوف السليمة دفعة واحدة، بينما تظهر الصفوف المرفوضة مع سبب الرفض.
+    </p>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    uploaded = st.file_uploader("ملف السجلات", type=['csv', 'xlsx'])
+    if uploaded is None:
+        return
+    
+    if st.button("استيراد السجلات", use_container_width=True):
+        with st.spinner("جاري استيراد السجلات..."):
+            imported, rejects = data_manager.import_families(uploaded, uploaded.name)
+        if rejects is None:
+            return
+        
+        st.success(f"تم استيراد {imported} عائلة")
+        if len(rejects):
+            st.warning(f"تم رفض {len(rejects)} صف")
+            st.dataframe(rejects, use_container_width=True, hide_index=True)
             st.download_button(
-                label="تحميل CSV (بديل)",
-                data=csv_data,
-                file_name=f"families_data_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
+                label="تحميل تقرير الصفوف المرفوضة",
+                data=rejects.to_csv(index=False).encode('utf-8-sig'),
+                file_name=f"rejected_{Path(uploaded.name).stem}.csv",
                 mime="text/csv",
                 use_container_width=True
             )
-    
-    with col_export3:
-        json_data = df.to_json(orient='records', force_ascii=False, indent=2)
-        st.download_button(
-            label="تحميل JSON",
-            data=json_data,
-            file_name=f"families_data_{datetime.now().strftime('%Y%m%d_%H%M')}.json",
-            mime="application/json",
-            use_container_width=True
-        )
 
+def metrics_admin():
+    token = os.environ.get('FAMILIES_ADMIN_TOKEN')
+    return metrics.enabled and bool(token) and st.query_params.get('admin') == token
+
+def render_metrics_panel(before):
+    spans, counters = metrics.snapshot()
+    previous_spans, previous_counters = before
+    this_run = [
+        {
+            'الدالة': span,
+            'الاستدعاءات': calls - previous_spans.get(span, (0, 0.0))[0],
+            'الزمن (ms)': round((seconds - previous_spans.get(span, (0, 0.0))[1]) * 1000, 1)
+        }
+        for span, (calls, seconds, _) in spans.items()
+        if calls > previous_spans.get(span, (0,))[0]
+    ]
+    totals = [
+        {
+            'الدالة': span,
+            'الاستدعاءات': calls,
+            'المتوسط (ms)': round(seconds / calls * 1000, 1),
+            'الأبطأ (ms)': round(slowest * 1000, 1)
+        }
+        for span, (calls, seconds, slowest) in spans.items()
+    ]
+    counts = [
+        {'العداد': f"{counter} ({kind})", 'هذا العرض': amount - previous_counters.get((counter, kind), 0), 'الإجمالي': amount}
+        for (counter, kind), amount in sorted(counters.items())
+    ]
+    
+    with st.sidebar.expander("قياسات الأداء"):
+        st.markdown("**هذا العرض**")
+        st.dataframe(sorted(this_run, key=lambda row: row['الزمن (ms)'], reverse=True), hide_index=True)
+        st.markdown("**منذ بدء التشغيل**")
+        st.dataframe(sorted(totals, key=lambda row: row['المتوسط (ms)'], reverse=True), hide_index=True)
+        st.dataframe(counts, hide_index=True)
+        if st.button("تصفير القياسات", key="metrics_reset"):
+            metrics.reset()
+
+@st.cache_resource
+def get_data_manager(backend, sharded=False):
+    return (ShardedDataManager if sharded else DataManager)(backend=backend, on_error=st.error)
+
+@instrumented
 def main():
+    metrics_before = metrics.snapshot()
     apply_custom_styling()
     
     st.markdown("""
@@ -648,9 +988,11 @@ def main():
     </div>
     """, unsafe_allow_html=True)
     
-    data_manager = DataManager()
-    
-    df = data_manager.load_data()
+    data_manager = get_data_manager(
+        os.environ.get('FAMILIES_BACKEND', 'csv'),
+        os.environ.get('FAMILIES_SHARDED') == '1'
+    )
+    summary = data_manager.summary()
     
     with st.sidebar:
         st.markdown("### القائمة الرئيسية")
@@ -662,15 +1004,22 @@ def main():
                 "تسجيل عائلة جديدة",
                 "لوحة الإحصائيات",
                 "القصص خلف الأرقام",
-                "عرض البيانات"
+                "عرض البيانات",
+                "تعديل بيانات عائلة",
+                "استيراد دفعة بيانات"
             ],
             label_visibility="collapsed"
         )
         
         st.markdown("---")
         st.markdown("### إحصائيات سريعة")
-        st.info(f"**إجمالي العائلات:** {len(df)}")
-        st.info(f"**إجمالي الأفراد:** {df['عدد_الأفراد'].sum() if not df.empty else 0}")
+        st.info(f"**إجمالي العائلات:** {summary['families']}")
+        st.info(f"**إجمالي الأفراد:** {summary['members']}")
+        if summary['write_error']:
+            st.warning(
+                f"**تعذر حفظ {summary['pending_writes']} من التسجيلات المعلقة حتى الآن، وستتم إعادة المحاولة تلقائياً:** "
+                f"{summary['write_error']}"
+            )
         
         st.markdown("---")
         st.markdown("""
@@ -686,13 +1035,19 @@ def main():
         render_data_entry_form(data_manager)
         
     elif page == "لوحة الإحصائيات":
-        render_analytics_dashboard(df)
+        render_analytics_dashboard(data_manager)
         
     elif page == "القصص خلف الأرقام":
-        render_stories_section(df)
+        render_stories_section(data_manager)
         
     elif page == "عرض البيانات":
-        render_data_table(df, data_manager)
+        render_data_table(data_manager)
+        
+    elif page == "تعديل بيانات عائلة":
+        render_family_editor(data_manager)
+        
+    elif page == "استيراد دفعة بيانات":
+        render_bulk_import(data_manager)
     
     st.markdown("<br><br>", unsafe_allow_html=True)
     st.markdown("---")
@@ -704,6 +1059,11 @@ def main():
         </p>
     </div>
     """, unsafe_allow_html=True)
+    
+    if metrics_admin():
+        render_metrics_panel(metrics_before)
+    if metrics.enabled and os.environ.get('FAMILIES_METRICS_FILE'):
+        metrics.write_prometheus(os.environ['FAMILIES_METRICS_FILE'])
 
 if __name__ == "__main__":
     main()
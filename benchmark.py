@@ -0,0 +1,853 @@
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import registry
+
+def make_family(name):
+    return {
+        'اسم_العائلة': name,
+        'عدد_الأفراد': 5,
+        'نوع_الفقد': "نزوح قسري",
+        'الاحتياجات_العاجلة': "غذاء ومياه, أدوية",
+        'الموقع_الجغرافي': "رفح",
+        'ملاحظات': "لا توجد ملاحظات",
+        'رقم_التواصل': "غير متوفر"
+    }
+
+def generate_families(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    needs_combinations = np.array([
+        ", ".join(need for bit, need in enumerate(registry.NEEDS_OPTIONS) if mask >> bit & 1)
+        for mask in range(1, 2 ** len(registry.NEEDS_OPTIONS))
+    ], dtype=object)
+    dates = pd.Timestamp("2023-10-07") + pd.to_timedelta(rng.integers(0, 60 * 24 * 700, rows), unit="min")
+    return pd.DataFrame({
+        'التاريخ': pd.Series(dates).sort_values().dt.strftime("%Y-%m-%d %H:%M").values,
+        'اسم_العائلة': [f"عائلة {i}" for i in range(rows)],
+        'عدد_الأفراد': rng.integers(1, 51, rows),
+        'نوع_الفقد': rng.choice(np.array(registry.LOSS_TYPES, dtype=object), rows),
+        'الاحتياجات_العاجلة': needs_combinations[rng.integers(0, len(needs_combinations), rows)],
+        'الموقع_الجغرافي': rng.choice(np.array(registry.LOCATIONS, dtype=object), rows),
+        'ملاحظات': "لا توجد ملاحظات",
+        'رقم_التواصل': "غير متوفر"
+    })
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+def insert_worker(args):
+    filename, worker_id, count, compact_threshold = args
+    data_manager = registry.DataManager(filename, compact_threshold=compact_threshold)
+    failures = 0
+    for i in range(count):
+        if not data_manager.add_family(make_family(f"w{worker_id}-{i}")):
+            failures += 1
+    return failures
+
+def read_worker(filename, stop_event, results):
+    data_manager = registry.DataManager(filename)
+    errors = []
+    last_count = 0
+    while not stop_event.is_set():
+        df = data_manager.load_data()
+        if df['اسم_العائلة'].duplicated().any():
+            errors.append(f"duplicate rows in snapshot of {len(df)}")
+        if len(df) < last_count:
+            errors.append(f"snapshot went back from {last_count} to {len(df)} rows")
+        last_count = len(df)
+    results.put(errors)
+
+def run_concurrency(args):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filename = str(Path(tmp_dir) / "families_data.csv")
+        stop_event = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        readers = [
+            multiprocessing.Process(target=read_worker, args=(filename, stop_event, results))
+            for _ in range(args.readers)
+        ]
+        for reader in readers:
+            reader.start()
+        
+        start = time.perf_counter()
+        with multiprocessing.Pool(args.writers) as pool:
+            failures = sum(pool.map(insert_worker, [
+                (filename, worker_id, args.inserts, args.compact_threshold)
+                for worker_id in range(args.writers)
+            ]))
+        elapsed = time.perf_counter() - start
+        
+        stop_event.set()
+        reader_errors = [error for _ in readers for error in results.get()]
+        for reader in readers:
+            reader.join()
+        
+        data_manager = registry.DataManager(filename)
+        df = data_manager.load_data()
+        aggregate_mismatches = data_manager.verify_aggregates()
+        expected = {f"w{w}-{i}" for w in range(args.writers) for i in range(args.inserts)}
+        lost = expected - set(df['اسم_العائلة'])
+        duplicates = int(df['اسم_العائلة'].duplicated().sum())
+    
+    total = args.writers * args.inserts
+    print(f"writers={args.writers} inserts={total} time={elapsed:.2f}s ({total / elapsed:.0f} inserts/s)")
+    print(f"rows={len(df)} lost={len(lost)} duplicates={duplicates} failed_writes={failures} "
+          f"aggregate_mismatches={sorted(aggregate_mismatches)}")
+    for error in reader_errors[:10]:
+        print(f"reader: {error}")
+    return 1 if lost or duplicates or failures or reader_errors or aggregate_mismatches else 0
+
+def run_backends(args):
+    print(f"{'rows':>9} {'backend':>8} {'operation':>16} {'seconds':>9}")
+    for rows in args.rows:
+        df = generate_families(rows)
+        for backend in args.backends:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                filename = Path(tmp_dir) / registry.STORAGE_BACKENDS[backend].default_filename
+                data_manager = registry.DataManager(filename, backend=backend)
+                results = {
+                    'bulk save': timed(data_manager.save_data, df)[0],
+                    'load all': timed(data_manager.load_data)[0],
+                    'metric cards': timed(data_manager.summary)[0],
+                    'location counts': timed(lambda: registry.aggregate_counts(data_manager.aggregates(), 'locations'))[0],
+                    'location filter': timed(data_manager.query_families, location="رفح")[0],
+                    'sort by date': timed(data_manager.query_families, sort_by='التاريخ')[0]
+                }
+                inserts = [timed(data_manager.add_family, make_family(f"new {i}"))[0] for i in range(args.inserts)]
+                results['add family'] = sum(inserts) / len(inserts)
+            for operation, seconds in results.items():
+                print(f"{rows:>9} {backend:>8} {operation:>16} {seconds:>9.4f}")
+    return 0
+
+def run_memory(args):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filename = Path(tmp_dir) / "families_data.csv"
+        data_manager = registry.DataManager(filename)
+        data_manager.save_data(generate_families(args.rows))
+        raw_seconds, raw_df = timed(pd.read_csv, filename, encoding='utf-8-sig')
+        typed_seconds, typed_df = timed(data_manager.load_data)
+    
+    report = registry.schema_memory_report(raw_df)
+    print(report.to_string())
+    before = report['bytes_before'].sum()
+    after = typed_df.memory_usage(deep=True, index=False).sum()
+    print(f"rows={args.rows} before={before / 2 ** 20:.1f}MiB after={after / 2 ** 20:.1f}MiB "
+          f"saved={1 - after / before:.0%}")
+    print(f"load raw={raw_seconds:.2f}s typed={typed_seconds:.2f}s")
+    return 0
+
+LOAD_VIEWS = {
+    'full load': lambda data_manager: data_manager.load_data(),
+    'dashboard columns': lambda data_manager: data_manager.load_data(columns=registry.AGGREGATE_COLUMNS),
+    'stories location': lambda data_manager: data_manager.query_families(columns=registry.COLUMNS, location="رفح"),
+    'table 3 columns': lambda data_manager: data_manager.query_families(
+        columns=['التاريخ', 'اسم_العائلة', 'عدد_الأفراد'],
+        sort_by='التاريخ'
+    )
+}
+
+def read_memory_status(field):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+def measure_view(args):
+    filename, backend, view = args
+    data_manager = registry.DataManager(filename, backend=backend)
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+    baseline = read_memory_status("VmRSS")
+    seconds, _ = timed(LOAD_VIEWS[view], data_manager)
+    return seconds, read_memory_status("VmHWM") - baseline
+
+def run_formats(args):
+    df = generate_families(args.rows)
+    spawn = multiprocessing.get_context("spawn")
+    print(f"{'backend':>8} {'view':>18} {'seconds':>8} {'peak RSS':>10}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for backend in args.backends:
+            filename = Path(tmp_dir) / registry.STORAGE_BACKENDS[backend].default_filename
+            registry.DataManager(filename, backend=backend).save_data(df)
+            for view in LOAD_VIEWS:
+                with spawn.Pool(1) as pool:
+                    seconds, peak = pool.apply(measure_view, ((filename, backend, view),))
+                print(f"{backend:>8} {view:>18} {seconds:>8.3f} {peak / 2 ** 20:>7.1f}MiB")
+    return 0
+
+def measure_export(args):
+    filename, backend, export_format, target = args
+    data_manager = registry.DataManager(filename, backend=backend)
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+    baseline = read_memory_status("VmRSS")
+    with open(target, "wb") as f:
+        seconds, _ = timed(data_manager.write_export, export_format, f)
+    return seconds, read_memory_status("VmHWM") - baseline, Path(target).stat().st_size
+
+def run_exports(args):
+    spawn = multiprocessing.get_context("spawn")
+    print(f"{'rows':>9} {'backend':>8} {'format':>6} {'seconds':>8} {'size':>10} {'peak RSS':>10}")
+    for rows in args.rows:
+        df = generate_families(rows)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for backend in args.backends:
+                filename = Path(tmp_dir) / registry.STORAGE_BACKENDS[backend].default_filename
+                registry.DataManager(filename, backend=backend).save_data(df)
+                for export_format in args.formats:
+                    target = Path(tmp_dir) / f"export.{export_format}"
+                    with spawn.Pool(1) as pool:
+                        seconds, peak, size = pool.apply(measure_export, ((filename, backend, export_format, target),))
+                    print(f"{rows:>9} {backend:>8} {export_format:>6} {seconds:>8.2f} "
+                          f"{size / 2 ** 20:>7.1f}MiB {peak / 2 ** 20:>7.1f}MiB")
+    return 0
+
+SEARCH_QUERIES = {
+    'one location': {'locations': ["رفح"]},
+    'location + needs': {'locations': ["رفح", "غزة"], 'needs': ["أدوية"]},
+    'five facets': {
+        'locations': ["رفح", "غزة"],
+        'loss_types': ["نزوح قسري"],
+        'needs': ["أدوية", "مأوى"],
+        'members': (3, 10),
+        'dates': (datetime.date(2024, 1, 1), datetime.date(2024, 6, 30))
+    },
+    'text': {'text': "عائلة 4242"},
+    'text + facets': {'text': "عائلة 12", 'locations': ["رفح"], 'members': (1, 5)}
+}
+
+def naive_search(df, locations=None, loss_types=None, needs=None, members=None, dates=None, text=None):
+    mask = pd.Series(True, index=df.index)
+    if locations:
+        mask &= df['الموقع_الجغرافي'].isin(locations)
+    if loss_types:
+        mask &= df['نوع_الفقد'].isin(loss_types)
+    if needs:
+        mask &= (df[registry.NEEDS_MASK_COLUMN].astype('int64') & registry.encode_needs(needs)) != 0
+    if members is not None:
+        mask &= df['عدد_الأفراد'].between(*members)
+    if dates is not None:
+        mask &= (df['التاريخ'] >= pd.Timestamp(dates[0])) & (df['التاريخ'] < pd.Timestamp(dates[1]) + pd.Timedelta(days=1))
+    for token in registry.tokenize(text or ''):
+        token_mask = pd.Series(False, index=df.index)
+        for column in registry.TEXT_COLUMNS:
+            normalized = df[column].astype(str).map(registry.normalize_arabic)
+            token_mask |= normalized.str.contains(rf"(?:^|\W){token}", regex=True)
+        mask &= token_mask
+    return np.flatnonzero(mask.to_numpy())
+
+def run_search(args):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filename = Path(tmp_dir) / "families_data.parquet"
+        registry.DataManager(filename, backend='parquet').save_data(generate_families(args.rows))
+        df = registry.ParquetStorage(filename).load()
+    build_seconds, index = timed(registry.RegistryIndex, df)
+    print(f"rows={args.rows} index build={build_seconds:.2f}s")
+    print(f"{'query':>16} {'matches':>8} {'index ms':>9} {'naive ms':>9}")
+    mismatches = 0
+    for name, filters in SEARCH_QUERIES.items():
+        index_seconds, positions = timed(index.search, **filters)
+        naive_seconds, expected = timed(naive_search, df, **filters)
+        if not np.array_equal(positions, expected):
+            mismatches += 1
+            print(f"{name}: index found {len(positions)} rows, naive scan {len(expected)}")
+        print(f"{name:>16} {len(positions):>8} {index_seconds * 1000:>9.1f} {naive_seconds * 1000:>9.1f}")
+    return 1 if mismatches else 0
+
+FIRST_NAMES = [
+    "محمد", "أحمد", "يوسف", "خالد", "إبراهيم", "عمر", "علي", "حسن", "سامي", "ناصر", "مصطفى", "عبد الله",
+    "محمود", "إسماعيل", "رائد", "فادي", "جهاد", "وليد", "زياد", "نبيل", "هاني", "طارق", "سعيد", "مازن",
+    "عادل", "رامي", "باسل", "أيمن", "ماهر", "كمال"
+]
+FAMILY_NAMES = [
+    "الكرد", "أبو شعبان", "النجار", "الحلو", "عاشور", "السقا", "المصري", "شعت", "الأغا", "حمدان",
+    "أبو ريا", "الشوا", "عياد", "البطش", "أبو عمرة", "الدحدوح", "حلس", "الزعانين", "قديح", "أبو حصيرة",
+    "الفرا", "شراب", "الهندي", "البورنو", "صيام"
+]
+
+def drop_letter(name):
+    longest = max(name.split(), key=len)
+    return name.replace(longest, longest[:2] + longest[3:])
+
+def misspell(name, rng):
+    variants = [
+        lambda: name.replace("أ", "ا").replace("إ", "ا").replace("ة", "ه"),
+        lambda: "عائلة " + name,
+        lambda: " ".join(reversed(name.split())),
+        lambda: drop_letter(name)
+    ]
+    return variants[rng.integers(len(variants))]()
+
+def generate_named_families(rows, duplicates, seed=0):
+    rng = np.random.default_rng(seed)
+    df = generate_families(rows, seed)
+    df['اسم_العائلة'] = [
+        f"{first} {father} {grandfather} {family}"
+        for first, father, grandfather, family in zip(
+            rng.choice(FIRST_NAMES, rows),
+            rng.choice(FIRST_NAMES, rows),
+            rng.choice(FIRST_NAMES, rows),
+            rng.choice(FAMILY_NAMES, rows)
+        )
+    ]
+    df['رقم_التواصل'] = [f"+970 59{number:07d}" for number in rng.integers(0, 10 ** 7, rows)]
+    df.loc[rng.random(rows) < 0.5, 'رقم_التواصل'] = "غير متوفر"
+    originals = df.sample(duplicates, random_state=seed)
+    copies = originals.assign(**{
+        'اسم_العائلة': [misspell(name, rng) for name in originals['اسم_العائلة']],
+        'رقم_التواصل': "غير متوفر"
+    })
+    return pd.concat([df, copies], ignore_index=True), originals.index.to_numpy()
+
+def run_duplicates(args):
+    for rows in args.rows:
+        df, originals = generate_named_families(rows, args.duplicates)
+        df = registry.apply_schema(registry.fill_needs_mask(df))
+        build_seconds, index = timed(registry.DuplicateIndex, df)
+        latencies = [
+            timed(index.candidates, record)[0]
+            for record in df.iloc[-args.duplicates:].to_dict('records')
+        ]
+        batch_seconds, pairs = timed(index.duplicate_pairs)
+        kept_rows = registry.duplicate_rows(pairs)
+        found = sum(rows + i in kept_rows for i in range(args.duplicates))
+        print(f"rows={rows} build={build_seconds:.2f}s submit p50={np.percentile(latencies, 50) * 1000:.2f}ms "
+              f"p99={np.percentile(latencies, 99) * 1000:.2f}ms batch={batch_seconds:.2f}s "
+              f"flagged={len(kept_rows)} injected found={found}/{args.duplicates}")
+    return 0
+
+def run_import(args):
+    print(f"{'rows':>9} {'backend':>8} {'seconds':>8} {'rows/s':>9}")
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source = Path(tmp_dir) / "batch.csv"
+            generate_families(rows).to_csv(source, index=False, encoding='utf-8-sig')
+            for backend in args.backends:
+                data_manager = registry.DataManager(Path(tmp_dir) / registry.STORAGE_BACKENDS[backend].default_filename, backend=backend)
+                with open(source, 'rb') as f:
+                    seconds, (imported, rejects) = timed(data_manager.import_families, f, source.name)
+                if imported != rows or len(rejects):
+                    print(f"{backend}: imported {imported} of {rows} rows, rejected {len(rejects)}")
+                    return 1
+                print(f"{rows:>9} {backend:>8} {seconds:>8.2f} {rows / seconds:>9.0f}")
+    return 0
+
+def run_edits(args):
+    print(f"{'rows':>9} {'backend':>8} {'update p50':>11} {'delete p50':>11} {'compaction':>11} {'consistent':>10}")
+    for rows in args.rows:
+        df = generate_families(rows)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for backend in args.backends:
+                data_manager = registry.DataManager(Path(tmp_dir) / registry.STORAGE_BACKENDS[backend].default_filename, backend=backend)
+                data_manager.save_data(df)
+                record_ids = data_manager.load_data(columns=[registry.RECORD_ID_COLUMN])[registry.RECORD_ID_COLUMN].sample(2 * args.edits, random_state=0).tolist()
+                data_manager.count_search({})
+                update_latencies = [
+                    timed(data_manager.update_family, record_id, {'عدد_الأفراد': 7, 'ملاحظات': "تم التصحيح"})[0]
+                    for record_id in record_ids[:args.edits]
+                ]
+                delete_latencies = [timed(data_manager.delete_family, record_id)[0] for record_id in record_ids[args.edits:]]
+                compaction_seconds, _ = timed(data_manager.compact_in_background().join)
+                consistent = (
+                    len(data_manager.load_data()) == rows - args.edits
+                    and data_manager.summary()['families'] == rows - args.edits
+                    and not data_manager.verify_aggregates()
+                )
+                print(f"{rows:>9} {backend:>8} {np.median(update_latencies) * 1000:>9.1f}ms "
+                      f"{np.median(delete_latencies) * 1000:>9.1f}ms {compaction_seconds:>10.2f}s {str(consistent):>10}")
+                if not consistent:
+                    return 1
+    return 0
+
+REGION_WEIGHTS = [0.4, 0.25, 0.15, 0.1, 0.07, 0.03]
+
+def region_insert_worker(args):
+    filename, backend, sharded, location, count = args
+    manager_class = registry.ShardedDataManager if sharded else registry.DataManager
+    data_manager = manager_class(filename, backend=backend)
+    failures = 0
+    for i in range(count):
+        if not data_manager.add_family({**make_family(f"{location}-{i}"), 'الموقع_الجغرافي': location}):
+            failures += 1
+    return failures
+
+def run_shards(args):
+    print(f"{'rows':>9} {'backend':>8} {'region':>20} {'shard rows':>10} {'sharded':>9} {'single':>9}")
+    failures = 0
+    for rows in args.rows:
+        df = generate_families(rows)
+        df['الموقع_الجغرافي'] = np.random.default_rng(1).choice(np.array(registry.LOCATIONS, dtype=object), rows, p=REGION_WEIGHTS)
+        for backend in args.backends:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                filename = Path(tmp_dir) / registry.STORAGE_BACKENDS[backend].default_filename
+                single = registry.DataManager(filename.with_name("single" + filename.suffix), backend=backend)
+                sharded = registry.ShardedDataManager(filename, backend=backend)
+                single.save_data(df)
+                sharded.save_data(df)
+                for location in registry.LOCATIONS:
+                    single.invalidate_cache()
+                    sharded.invalidate_cache()
+                    single_seconds, expected = timed(single.query_families, location=location)
+                    sharded_seconds, result = timed(sharded.query_families, location=location)
+                    failures += len(result) != len(expected)
+                    print(f"{rows:>9} {backend:>8} {location:>20} {len(result):>10} "
+                          f"{sharded_seconds:>8.3f}s {single_seconds:>8.3f}s")
+                single.invalidate_cache()
+                sharded.invalidate_cache()
+                single_seconds, single_summary = timed(single.summary)
+                sharded_seconds, sharded_summary = timed(sharded.summary)
+                failures += single_summary != sharded_summary
+                print(f"{rows:>9} {backend:>8} {'all regions summary':>20} {rows:>10} "
+                      f"{sharded_seconds:>8.3f}s {single_seconds:>8.3f}s")
+                
+                for mode in [False, True]:
+                    with multiprocessing.Pool(len(registry.LOCATIONS)) as pool:
+                        start = time.perf_counter()
+                        failures += sum(pool.map(region_insert_worker, [
+                            (filename.with_name("single" + filename.suffix) if not mode else filename,
+                             backend, mode, location, args.inserts)
+                            for location in registry.LOCATIONS
+                        ]))
+                        elapsed = time.perf_counter() - start
+                    total = len(registry.LOCATIONS) * args.inserts
+                    print(f"{rows:>9} {backend:>8} {'sharded' if mode else 'single'} writers: "
+                          f"{total / elapsed:.0f} inserts/s across {len(registry.LOCATIONS)} regions")
+                mismatches = sharded.verify_aggregates()
+                failures += bool(mismatches)
+    return 1 if failures else 0
+
+APP_FILE = Path(__file__).resolve().with_name("My_Streamlit_ app.py")
+
+STARTUP_SCRIPT = """
+import sys
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file(sys.argv[1], default_timeout=120).run()
+page = int(sys.argv[2])
+if page:
+    at.sidebar.radio[0].set_value(at.sidebar.radio[0].options[page]).run()
+if at.exception:
+    raise SystemExit(str(at.exception[0].value))
+"""
+
+STARTUP_PACKAGES = {
+    'streamlit': ['streamlit'],
+    'pandas': ['pandas', 'numpy'],
+    'plotly': ['plotly', 'narwhals'],
+    'excel': ['openpyxl', 'xlsxwriter'],
+    'pyarrow': ['pyarrow']
+}
+
+def measure_startup(code, args, cwd):
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code, *args],
+        cwd=cwd, env=dict(os.environ, PYTHONPATH=str(APP_FILE.parent)), capture_output=True, text=True
+    )
+    seconds = time.perf_counter() - start
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    self_times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        package = name.strip().split(".")[0]
+        self_times[package] = self_times.get(package, 0) + int(self_us)
+    return seconds, self_times
+
+def run_startup(args):
+    pages = ["تسجيل عائلة جديدة", "لوحة الإحصائيات", "القصص خلف الأرقام", "عرض البيانات", "تعديل بيانات عائلة", "استيراد دفعة بيانات"]
+    print(f"{'page':>20} {'seconds':>8} {'imports':>9} " + " ".join(f"{package:>9}" for package in STARTUP_PACKAGES))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        registry.DataManager(Path(tmp_dir) / registry.CsvStorage.default_filename).save_data(generate_families(args.rows))
+        runs = [("cli (registry only)", "import registry", [])]
+        runs += [(page, STARTUP_SCRIPT, [str(APP_FILE), str(index)]) for index, page in enumerate(pages)]
+        for label, code, script_args in runs:
+            samples = [measure_startup(code, script_args, tmp_dir) for _ in range(args.repeat)]
+            seconds, self_times = min(samples, key=lambda sample: sum(sample[1].values()))
+            packages = {
+                package: sum(self_times.get(module, 0) for module in modules)
+                for package, modules in STARTUP_PACKAGES.items()
+            }
+            print(f"{label:>20} {seconds:>8.2f} {sum(self_times.values()) / 1000:>7.0f}ms " +
+                  " ".join(f"{us / 1000:>7.0f}ms" for us in packages.values()))
+    return 0
+
+CHART_PAYLOAD_LIMIT = 16 * 1024
+
+def run_charts(args):
+    from streamlit.testing.v1 import AppTest
+    
+    print(f"{'rows':>9} " + " ".join(f"{chart:>13}" for chart in ['locations', 'loss_types', 'needs', 'family_sizes', 'timeline']))
+    oversized = 0
+    cwd = os.getcwd()
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            registry.DataManager(Path(tmp_dir) / registry.CsvStorage.default_filename).save_data(generate_families(rows))
+            os.chdir(tmp_dir)
+            try:
+                at = AppTest.from_file(str(APP_FILE), default_timeout=600).run()
+                at.sidebar.radio[0].set_value("لوحة الإحصائيات").run()
+            finally:
+                os.chdir(cwd)
+            sizes = [len(chart.proto.spec.encode('utf-8')) for chart in at.get('plotly_chart')]
+            oversized += sum(size > CHART_PAYLOAD_LIMIT for size in sizes)
+            print(f"{rows:>9} " + " ".join(f"{size / 1024:>11.1f}KB" for size in sizes))
+    if oversized:
+        print(f"{oversized} chart payloads exceed {CHART_PAYLOAD_LIMIT // 1024}KB")
+        return 1
+    return 0
+
+def submit_worker(data_manager, worker_id, count, latencies):
+    for i in range(count):
+        seconds, submitted = timed(data_manager.submit_family, make_family(f"w{worker_id}-{i}"))
+        latencies.append(seconds if submitted else float('nan'))
+
+def crashed_submitter(filename, backend, count):
+    data_manager = registry.DataManager(filename, backend=backend, write_batch_size=count)
+    for i in range(count):
+        data_manager.submit_family(make_family(f"crash-{i}"))
+    # exit like a killed server, before the writer thread drains the journal
+    os._exit(0)
+
+def run_writes(args):
+    spawn = multiprocessing.get_context("spawn")
+    print(f"{'backend':>8} {'batch':>6} {'submit p50':>11} {'submit p99':>11} {'families/s':>11} {'replayed':>9} {'consistent':>10}")
+    failures = 0
+    for backend in args.backends:
+        for batch_size in args.batch_sizes:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                filename = Path(tmp_dir) / registry.STORAGE_BACKENDS[backend].default_filename
+                data_manager = registry.DataManager(filename, backend=backend, write_batch_size=batch_size)
+                data_manager.save_data(generate_families(args.rows))
+                latencies = []
+                workers = [
+                    threading.Thread(target=submit_worker, args=(data_manager, worker_id, args.submits, latencies))
+                    for worker_id in range(args.writers)
+                ]
+                start = time.perf_counter()
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+                data_manager.flush_writes()
+                elapsed = time.perf_counter() - start
+                
+                total = args.writers * args.submits
+                names = registry.DataManager(filename, backend=backend).load_data(columns=['اسم_العائلة'])['اسم_العائلة']
+                
+                # A new process must see families a crashed writer acknowledged without anyone submitting again
+                crashed = spawn.Process(target=crashed_submitter, args=(filename, backend, args.crash_submits))
+                crashed.start()
+                crashed.join()
+                expected = args.rows + total + args.crash_submits
+                replayed = expected - registry.STORAGE_BACKENDS[backend](filename).count()
+                restarted = registry.DataManager(filename, backend=backend)
+                consistent = (
+                    len(names) == args.rows + total
+                    and not names.duplicated().any()
+                    and not np.isnan(latencies).any()
+                    and not data_manager.verify_aggregates()
+                    and restarted.summary()['families'] == expected
+                    and len(restarted.load_data(columns=['اسم_العائلة'])) == expected
+                    and restarted.count_search({}) == expected
+                )
+                failures += not consistent
+                print(f"{backend:>8} {batch_size:>6} {np.percentile(latencies, 50) * 1000:>9.2f}ms "
+                      f"{np.percentile(latencies, 99) * 1000:>9.2f}ms {total / elapsed:>11.0f} {replayed:>9} {str(consistent):>10}")
+    return 1 if failures else 0
+
+def run_instrumentation(args):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_manager = registry.DataManager(Path(tmp_dir) / registry.CsvStorage.default_filename)
+        data_manager.save_data(generate_families(args.rows))
+        data_manager.count_families()
+        calls = {
+            'uninstrumented': (
+                lambda: registry.DataManager.count_families.__wrapped__(data_manager),
+                lambda: registry.DataManager.load_data.__wrapped__(data_manager)
+            ),
+            'disabled': (data_manager.count_families, data_manager.load_data),
+            'enabled': (data_manager.count_families, data_manager.load_data)
+        }
+        print(f"{'metrics':>14} {'cached call':>12} {'load_data':>10}")
+        for mode, (call, load) in calls.items():
+            registry.metrics.enabled = mode == 'enabled'
+            call_seconds = min(timed(lambda: [call() for _ in range(args.calls)])[0] for _ in range(5)) / args.calls
+            load_seconds = min(timed(lambda: (data_manager.invalidate_cache(), load()))[0] for _ in range(3))
+            print(f"{mode:>14} {call_seconds * 1e6:>10.2f}us {load_seconds:>9.3f}s")
+        registry.metrics.enabled = False
+    return 0
+
+def run_snapshots(args):
+    print(f"{'rows':>9} {'backend':>8} {'file':>9} {'snapshot':>9} {'write':>7} {'cold load':>10} {'warm load':>10} "
+          f"{'after writes':>13} {'restore':>8} {'consistent':>10}")
+    failures = 0
+    for rows in args.rows:
+        df = generate_registry(rows)
+        for backend in args.backends:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                filename = Path(tmp_dir) / registry.STORAGE_BACKENDS[backend].default_filename
+                registry.DataManager(filename, backend=backend).save_data(df)
+                cold_seconds, expected = timed(registry.DataManager(filename, backend=backend).load_data)
+                write_seconds, entry = timed(registry.DataManager(filename, backend=backend).snapshot)
+                warm_seconds, warm = timed(registry.DataManager(filename, backend=backend).load_data)
+                
+                # Writes after the snapshot go to the log, which a new process applies on top of it
+                data_manager = registry.DataManager(filename, backend=backend)
+                for i in range(args.writes):
+                    data_manager.add_family(make_family(f"after-{i}"))
+                data_manager.delete_family(expected[registry.RECORD_ID_COLUMN].iloc[0])
+                written_seconds, written = timed(registry.DataManager(filename, backend=backend).load_data)
+                current = registry.STORAGE_BACKENDS[backend](filename).load()
+                restore_seconds, _ = timed(data_manager.restore_snapshot)
+                restored = registry.DataManager(filename, backend=backend).load_data()
+                consistent = (
+                    warm.equals(expected)
+                    and written.equals(current)
+                    and restored[registry.RECORD_ID_COLUMN].tolist() == expected[registry.RECORD_ID_COLUMN].tolist()
+                    and not data_manager.verify_aggregates()
+                )
+                failures += not consistent
+                file_size = sum(path.stat().st_size for path in Path(tmp_dir).glob(filename.name))
+                print(f"{rows:>9} {backend:>8} {file_size / 2 ** 20:>6.1f}MiB {entry['bytes'] / 2 ** 20:>6.1f}MiB "
+                      f"{write_seconds:>6.2f}s {cold_seconds:>9.2f}s {warm_seconds:>9.2f}s {written_seconds:>12.2f}s "
+                      f"{restore_seconds:>7.2f}s {str(consistent):>10}")
+    return 1 if failures else 0
+
+NOTE_SITUATIONS = [
+    "نزحت العائلة عدة مرات منذ بداية الحرب",
+    "تقيم العائلة في خيمة قرب مدرسة للإيواء",
+    "استشهد رب الأسرة وتعيل الأم الأطفال وحدها",
+    "دُمّر المنزل بالكامل في قصف ليلي",
+    "تعيش العائلة لدى أقارب في شقة مكتظة",
+    "أحد الأطفال مصاب بكسر ويحتاج متابعة",
+    "الجدة مريضة سكري وانقطع عنها الدواء",
+    "فقد الأب عمله بعد تدمير الورشة"
+]
+NOTE_REQUESTS = [
+    "بحاجة ماسة إلى خيمة وأغطية للشتاء",
+    "يحتاجون مياه صالحة للشرب بشكل يومي",
+    "الأطفال بحاجة إلى دعم نفسي",
+    "لا يوجد مصدر دخل حالياً",
+    "يرجى التواصل مع الأخ الأكبر عند توفر المساعدات",
+    "تم استلام طرد غذائي واحد الشهر الماضي"
+]
+
+def generate_registry(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    df = generate_named_families(rows, 0, seed)[0]
+    notes = [
+        f"{situation}، {request}."
+        for situation, request in zip(rng.choice(NOTE_SITUATIONS, rows), rng.choice(NOTE_REQUESTS, rows))
+    ]
+    df['ملاحظات'] = np.where(rng.random(rows) < 0.3, "لا توجد ملاحظات", notes)
+    return df
+
+SUITE_INSERTS = 20
+
+def prepare_page(page):
+    def prepare(data_manager):
+        from streamlit.testing.v1 import AppTest
+        return AppTest.from_file(str(APP_FILE), default_timeout=1800).run(), page
+    return prepare
+
+def render_page(state):
+    at, page = state
+    at.sidebar.radio[0].set_value(page).run()
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+
+def export_to_file(export_format):
+    def run(data_manager):
+        with open(os.devnull, 'wb') as f:
+            data_manager.write_export(export_format, f)
+    return run
+
+def add_families(data_manager):
+    for i in range(SUITE_INSERTS):
+        data_manager.add_family(make_family(f"عائلة جديدة {i}"))
+
+SUITE_CASES = {
+    'load_data': (lambda data_manager: data_manager, lambda data_manager: data_manager.load_data()),
+    'export csv': (lambda data_manager: data_manager, export_to_file('csv')),
+    'export xlsx': (lambda data_manager: data_manager, export_to_file('xlsx')),
+    'export json': (lambda data_manager: data_manager, export_to_file('json')),
+    'dashboard page': (prepare_page("لوحة الإحصائيات"), render_page),
+    'stories page': (prepare_page("القصص خلف الأرقام"), render_page),
+    f'add_family x{SUITE_INSERTS}': (lambda data_manager: data_manager, add_families)
+}
+
+def measure_case(args):
+    workdir, case = args
+    os.chdir(workdir)
+    prepare, run = SUITE_CASES[case]
+    state = prepare(registry.DataManager(registry.CsvStorage.default_filename))
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+    baseline = read_memory_status("VmRSS")
+    seconds, _ = timed(run, state)
+    return seconds, read_memory_status("VmHWM") - baseline
+
+def git_commit():
+    result = subprocess.run(["git", "rev-parse", "HEAD"], cwd=APP_FILE.parent, capture_output=True, text=True)
+    return result.stdout.strip() or None
+
+def run_suite(args):
+    spawn = multiprocessing.get_context("spawn")
+    results = []
+    print(f"{'rows':>9} {'case':>16} {'seconds':>9} {'peak RSS':>10}")
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            registry.DataManager(Path(tmp_dir) / registry.CsvStorage.default_filename).save_data(generate_registry(rows))
+            for case in args.cases:
+                with spawn.Pool(1) as pool:
+                    seconds, peak = pool.apply(measure_case, ((tmp_dir, case),))
+                results.append({'rows': rows, 'case': case, 'seconds': seconds, 'peak_bytes': peak})
+                print(f"{rows:>9} {case:>16} {seconds:>9.3f} {peak / 2 ** 20:>7.1f}MiB")
+    
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'commit': git_commit(),
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'pandas': pd.__version__,
+            'results': results
+        }, f, ensure_ascii=False, indent=2)
+    print(f"saved {len(results)} results to {args.output}")
+    
+    if args.baseline is None:
+        return 0
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    previous = {(result['rows'], result['case']): result for result in baseline['results']}
+    print(f"\ncompared with {args.baseline} ({baseline.get('commit') or 'unknown commit'})")
+    print(f"{'rows':>9} {'case':>16} {'time':>8} {'memory':>8}")
+    regressions = 0
+    for result in results:
+        before = previous.get((result['rows'], result['case']))
+        if before is None:
+            continue
+        time_ratio = result['seconds'] / max(before['seconds'], 1e-9)
+        memory_ratio = result['peak_bytes'] / max(before['peak_bytes'], 1)
+        regressed = time_ratio > 1 + args.tolerance or memory_ratio > 1 + args.tolerance
+        regressions += regressed
+        print(f"{result['rows']:>9} {result['case']:>16} {time_ratio:>7.2f}x {memory_ratio:>7.2f}x"
+              + ("  regression" if regressed else ""))
+    return 1 if regressions else 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the families registry storage")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    concurrency = subparsers.add_parser("concurrency", help="concurrent multi-process inserts with readers")
+    concurrency.add_argument("--writers", type=int, default=8)
+    concurrency.add_argument("--inserts", type=int, default=50, help="inserts per writer")
+    concurrency.add_argument("--readers", type=int, default=2)
+    concurrency.add_argument("--compact-threshold", type=int, default=16 * 1024)
+    concurrency.set_defaults(func=run_concurrency)
+    
+    backends = subparsers.add_parser("backends", help="compare storage backends on the dashboard queries")
+    backends.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    backends.add_argument("--backends", nargs="+", choices=registry.STORAGE_BACKENDS, default=list(registry.STORAGE_BACKENDS))
+    backends.add_argument("--inserts", type=int, default=20, help="single-family inserts to average")
+    backends.set_defaults(func=run_backends)
+    
+    memory = subparsers.add_parser("memory", help="memory of the raw versus the typed families frame")
+    memory.add_argument("--rows", type=int, default=1_000_000)
+    memory.set_defaults(func=run_memory)
+    
+    formats = subparsers.add_parser("formats", help="load time and peak RSS per view for each on-disk format")
+    formats.add_argument("--rows", type=int, default=1_000_000)
+    formats.add_argument("--backends", nargs="+", choices=registry.STORAGE_BACKENDS, default=['csv', 'parquet'])
+    formats.set_defaults(func=run_formats)
+    
+    exports = subparsers.add_parser("exports", help="export time and peak RSS per download format")
+    exports.add_argument("--rows", type=int, nargs="+", default=[100_000, 400_000])
+    exports.add_argument("--backends", nargs="+", choices=registry.STORAGE_BACKENDS, default=['csv', 'sqlite'])
+    exports.add_argument("--formats", nargs="+", choices=registry.EXPORT_FORMATS, default=list(registry.EXPORT_FORMATS))
+    exports.set_defaults(func=run_exports)
+    
+    search = subparsers.add_parser("search", help="indexed multi-facet search against boolean-mask scans")
+    search.add_argument("--rows", type=int, default=1_000_000)
+    search.set_defaults(func=run_search)
+    
+    duplicates = subparsers.add_parser("duplicates", help="duplicate detection latency, batch time and recall")
+    duplicates.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    duplicates.add_argument("--duplicates", type=int, default=1000, help="misspelled copies to inject")
+    duplicates.set_defaults(func=run_duplicates)
+    
+    bulk_import = subparsers.add_parser("import", help="bulk import of a field CSV batch")
+    bulk_import.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000])
+    bulk_import.add_argument("--backends", nargs="+", choices=registry.STORAGE_BACKENDS, default=list(registry.STORAGE_BACKENDS))
+    bulk_import.set_defaults(func=run_import)
+    
+    edits = subparsers.add_parser("edits", help="update and delete latency by registry size, then compaction")
+    edits.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    edits.add_argument("--backends", nargs="+", choices=registry.STORAGE_BACKENDS, default=list(registry.STORAGE_BACKENDS))
+    edits.add_argument("--edits", type=int, default=200, help="updates and deletes to time")
+    edits.set_defaults(func=run_edits)
+    
+    writes = subparsers.add_parser("writes", help="submit latency and throughput of the write queue by group-commit batch size")
+    writes.add_argument("--rows", type=int, default=100_000, help="families already in the registry")
+    writes.add_argument("--backends", nargs="+", choices=registry.STORAGE_BACKENDS, default=['csv', 'sqlite'])
+    writes.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 16, 64, 256])
+    writes.add_argument("--writers", type=int, default=8, help="threads submitting families")
+    writes.add_argument("--submits", type=int, default=250, help="submissions per thread")
+    writes.add_argument("--crash-submits", type=int, default=50, help="submissions left in the journal by a crashed writer")
+    writes.set_defaults(func=run_writes)
+    
+    snapshots = subparsers.add_parser("snapshots", help="snapshot size, write time, warm start and restore against parsing the registry")
+    snapshots.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    snapshots.add_argument("--backends", nargs="+", choices=registry.STORAGE_BACKENDS, default=list(registry.STORAGE_BACKENDS))
+    snapshots.add_argument("--writes", type=int, default=100, help="families added after the snapshot before the warm start is timed again")
+    snapshots.set_defaults(func=run_snapshots)
+    
+    instrumentation = subparsers.add_parser("instrumentation", help="cost of the timing spans when metrics are off and on")
+    instrumentation.add_argument("--rows", type=int, default=100_000)
+    instrumentation.add_argument("--calls", type=int, default=100_000, help="cached calls per timing")
+    instrumentation.set_defaults(func=run_instrumentation)
+    
+    suite = subparsers.add_parser("suite", help="time and peak RSS of the main paths on synthetic registries, saved as JSON")
+    suite.add_argument("--rows", type=int, nargs="+", default=[1_000, 100_000, 1_000_000])
+    suite.add_argument("--cases", nargs="+", choices=SUITE_CASES, default=list(SUITE_CASES))
+    suite.add_argument("--output", default="benchmark_results.json", help="JSON file for the results")
+    suite.add_argument("--baseline", help="earlier results file to compare against")
+    suite.add_argument("--tolerance", type=float, default=0.2, help="slowdown or memory growth reported as a regression")
+    suite.set_defaults(func=run_suite)
+    
+    shards = subparsers.add_parser("shards", help="region-scoped scans and per-region writers, sharded against a single file")
+    shards.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    shards.add_argument("--backends", nargs="+", choices=registry.STORAGE_BACKENDS, default=list(registry.STORAGE_BACKENDS))
+    shards.add_argument("--inserts", type=int, default=50, help="inserts per region writer")
+    shards.set_defaults(func=run_shards)
+    
+    startup = subparsers.add_parser("startup", help="import cost of the CLI and of opening each app page in a fresh process")
+    startup.add_argument("--rows", type=int, default=1000, help="families in the registry the pages render")
+    startup.add_argument("--repeat", type=int, default=3, help="runs per page, keeping the fastest")
+    startup.set_defaults(func=run_startup)
+    
+    charts = subparsers.add_parser("charts", help="serialized dashboard chart sizes as the registry grows")
+    charts.add_argument("--rows", type=int, nargs="+", default=[1_000, 100_000, 1_000_000])
+    charts.set_defaults(func=run_charts)
+    
+    args = parser.parse_args()
+    return args.func(args)
+
+if __name__ == "__main__":
+    raise SystemExit(main())
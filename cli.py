@@ -0,0 +1,147 @@
+import argparse
+import json
+import os
+import sys
+
+import registry
+
+def print_counts(title, counts):
+    print(f"\n{title}")
+    for value, count in counts.items():
+        print(f"  {value}: {count}")
+
+def run_report(data_manager, args):
+    report = registry.dashboard_report(data_manager.aggregates())
+    if args.format == "json":
+        json.dump(
+            {key: value if key == 'summary' else value.to_dict() for key, value in report.items()},
+            sys.stdout,
+            ensure_ascii=False,
+            indent=2
+        )
+        print()
+        return 0
+    
+    summary = report['summary']
+    print(f"إجمالي العائلات المسجلة: {summary['families']}")
+    print(f"إجمالي الأفراد: {summary['members']}")
+    print(f"متوسط أفراد العائلة: {summary['avg_members']:.1f}")
+    print(f"المناطق المتأثرة: {summary['locations']}")
+    print_counts("التوزيع الجغرافي للعائلات", report['locations'])
+    print_counts("أنواع الفقد والأضرار", report['loss_types'])
+    print_counts("الاحتياجات العاجلة الأكثر طلباً", report['needs'])
+    print_counts("توزيع أحجام العائلات", report['family_sizes'].sort_index(key=lambda sizes: sizes.astype(int)))
+    return 0
+
+def run_export(data_manager, args):
+    output = args.output or f"families_data.{registry.EXPORT_FORMATS[args.format]['extension']}"
+    with open(output, 'wb') as f:
+        data_manager.write_export(args.format, f)
+    print(f"exported {data_manager.filename} to {output}")
+    return 0
+
+def run_import(data_manager, args):
+    if not os.path.isfile(args.source):
+        print(f"{args.source} does not exist", file=sys.stderr)
+        return 2
+    with open(args.source, 'rb') as f:
+        imported, rejects = data_manager.import_families(f, args.source, chunk_rows=args.chunk_rows)
+    if rejects is None:
+        return 1
+    if args.rejects:
+        rejects.to_csv(args.rejects, index=False, encoding='utf-8-sig')
+    print(f"imported {imported} families into {data_manager.filename}, rejected {len(rejects)} rows")
+    return 0 if imported or not len(rejects) else 1
+
+def run_compact(data_manager, args):
+    if not data_manager.compact():
+        return 1
+    print(f"compacted {data_manager.filename}")
+    return 0
+
+def run_dedupe(data_manager, args):
+    report = data_manager.deduplicate(min_score=args.min_score, dry_run=not args.apply)
+    if report is None:
+        return 1
+    if args.report:
+        report.to_csv(args.report, index=False, encoding='utf-8-sig')
+    removable = int(report['حذف_تلقائي'].sum())
+    action = "removed" if args.apply else "found"
+    print(f"{action} {removable} duplicate families in {data_manager.filename}, "
+          f"{len(report) - removable} more to review by hand")
+    return 0
+
+def run_snapshot(data_manager, args):
+    if args.list:
+        shards = getattr(data_manager, 'shards', {None: data_manager})
+        for shard, manager in shards.items():
+            for entry in manager.snapshots.entries():
+                prefix = f"{shard}: " if shard else ""
+                print(f"{prefix}{entry['name']} {entry['created']} rows={entry['rows']} "
+                      f"size={entry['bytes'] / 2 ** 20:.1f}MiB sha256={entry['sha256'][:12]}")
+        return 0
+    if data_manager.snapshot() is None:
+        return 1
+    print(f"snapshotted {data_manager.filename}")
+    return 0
+
+def run_restore(data_manager, args):
+    if args.name and args.sharded:
+        print("--name picks a single snapshot, restore a shard by passing its file with --file", file=sys.stderr)
+        return 2
+    if not data_manager.restore_snapshot(args.name):
+        return 1
+    print(f"restored {data_manager.filename} from {args.name or 'the latest snapshot'}")
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Reports and batch jobs for the families registry")
+    parser.add_argument("--backend", choices=registry.STORAGE_BACKENDS, default=os.environ.get('FAMILIES_BACKEND', 'csv'))
+    parser.add_argument("--file", help="registry file (defaults to the backend's default file)")
+    parser.add_argument("--sharded", action="store_true", default=os.environ.get('FAMILIES_SHARDED') == '1',
+                        help="keep one shard per region next to the registry file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    report = subparsers.add_parser("report", help="the dashboard figures as text or JSON")
+    report.add_argument("--format", choices=["text", "json"], default="text")
+    report.set_defaults(func=run_report)
+    
+    export = subparsers.add_parser("export", help="stream the registry to a CSV, Excel or JSON file")
+    export.add_argument("--format", choices=registry.EXPORT_FORMATS, default="csv")
+    export.add_argument("--output", help="output file (defaults to families_data.<format>)")
+    export.set_defaults(func=run_export)
+    
+    bulk_import = subparsers.add_parser("import", help="import a CSV or Excel batch of field-collected families")
+    bulk_import.add_argument("source", help="CSV or .xlsx file with the export columns")
+    bulk_import.add_argument("--rejects", help="write rejected rows with the reason to this CSV file")
+    bulk_import.add_argument("--chunk-rows", type=int, default=registry.IMPORT_CHUNK_ROWS)
+    bulk_import.set_defaults(func=run_import)
+    
+    compact = subparsers.add_parser("compact", help="fold the append log into the base file")
+    compact.set_defaults(func=run_compact)
+    
+    dedupe = subparsers.add_parser("dedupe", help="report duplicate registrations, and with --apply remove them")
+    dedupe.add_argument("--min-score", type=float, default=1.0,
+                        help="lowest name similarity treated as a duplicate (1.0 keeps to exact normalized names)")
+    dedupe.add_argument("--apply", action="store_true",
+                        help="remove the duplicates that share a location and contact, keeping the earliest one")
+    dedupe.add_argument("--report", help="write the duplicate families to this CSV file")
+    dedupe.set_defaults(func=run_dedupe)
+    
+    snapshot = subparsers.add_parser("snapshot", help="write a compressed, checksummed snapshot of the registry")
+    snapshot.add_argument("--list", action="store_true", help="list the kept snapshots instead of taking one")
+    snapshot.set_defaults(func=run_snapshot)
+    
+    restore = subparsers.add_parser("restore", help="replace the registry with a snapshot")
+    restore.add_argument("--name", help="snapshot file name (defaults to the latest)")
+    restore.set_defaults(func=run_restore)
+    
+    args = parser.parse_args()
+    manager_class = registry.ShardedDataManager if args.sharded else registry.DataManager
+    status = args.func(manager_class(args.file, backend=args.backend), args)
+    if registry.metrics.enabled and os.environ.get('FAMILIES_METRICS_FILE'):
+        registry.metrics.write_prometheus(os.environ['FAMILIES_METRICS_FILE'])
+    return status
+
+if __name__ == "__main__":
+    raise SystemExit(main())
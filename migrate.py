@@ -0,0 +1,56 @@
+import argparse
+import sys
+from pathlib import Path
+
+import registry
+
+def read_source(source):
+    # DataManager.load_data reports read errors and returns an empty frame, which would then be saved over the data
+    try:
+        return source.storage.load()
+    except Exception as e:
+        print(f"could not read {source.filename}: {e}", file=sys.stderr)
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="One-shot copy of the families registry between storage backends")
+    parser.add_argument("--from", dest="source_backend", choices=registry.STORAGE_BACKENDS, default="csv")
+    parser.add_argument("--to", dest="target_backend", choices=registry.STORAGE_BACKENDS, default="sqlite")
+    parser.add_argument("--source", help="source file (defaults to the backend's default file)")
+    parser.add_argument("--target", help="target file (defaults to the backend's default file)")
+    parser.add_argument("--force", action="store_true", help="overwrite a target that already holds families")
+    parser.add_argument("--sharded", action="store_true", help="split the target into one shard per region")
+    parser.add_argument("--backfill-needs", action="store_true",
+                        help="rewrite the source in place with the needs bitmask and record id columns filled in")
+    args = parser.parse_args()
+    
+    source_path = Path(args.source or registry.STORAGE_BACKENDS[args.source_backend].default_filename)
+    if args.backfill_needs:
+        source = registry.DataManager(source_path, backend=args.source_backend)
+        df = read_source(source)
+        if df is None or not source.save_data(df):
+            return 1
+        print(f"backfilled the needs bitmask and record ids for {len(df)} families in {source.filename}")
+        return 0
+    
+    target_path = Path(args.target or registry.STORAGE_BACKENDS[args.target_backend].default_filename)
+    if not args.sharded and source_path.resolve() == target_path.resolve():
+        parser.error("source and target are the same file")
+    
+    source = registry.DataManager(source_path, backend=args.source_backend)
+    target_class = registry.ShardedDataManager if args.sharded else registry.DataManager
+    target = target_class(target_path, backend=args.target_backend)
+    if source.summary()['families'] == 0:
+        parser.error(f"{source.filename} holds no families to migrate")
+    if target.summary()['families'] and not args.force:
+        parser.error(f"{target.filename} already holds families, use --force to overwrite it")
+    
+    df = read_source(source)
+    if df is None or not target.save_data(df):
+        return 1
+    print(f"migrated {len(df)} families from {source.filename} ({args.source_backend}) "
+          f"to {target.filename} ({args.target_backend})")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
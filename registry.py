@@ -0,0 +1,2745 @@
+import bisect
+import difflib
+import functools
+import hashlib
+import importlib.util
+import itertools
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+COLUMNS = [
+    'التاريخ',
+    'اسم_العائلة',
+    'عدد_الأفراد',
+    'نوع_الفقد',
+    'الاحتياجات_العاجلة',
+    'الموقع_الجغرافي',
+    'ملاحظات',
+    'رقم_التواصل'
+]
+
+LOSS_TYPES = [
+    "فقد أحد أفراد العائلة",
+    "فقد المنزل بالكامل",
+    "فقد المنزل جزئياً",
+    "فقد مصدر الدخل",
+    "إصابات جسدية",
+    "نزوح قسري",
+    "متعدد (فقد وإصابات)"
+]
+
+NEEDS_OPTIONS = [
+    "مأوى مؤقت",
+    "غذاء ومياه",
+    "رعاية طبية",
+    "أدوية",
+    "ملابس",
+    "مواد نظافة",
+    "دعم نفسي",
+    "مساعدات مالية"
+]
+
+LOCATIONS = [
+    "شمال غزة",
+    "غزة",
+    "الوسطى (دير البلح)",
+    "خان يونس",
+    "رفح",
+    "نازح خارج القطاع"
+]
+
+NEEDS_MASK_COLUMN = 'رمز_الاحتياجات'
+RECORD_ID_COLUMN = 'رقم_السجل'
+
+STORED_COLUMNS = COLUMNS + [NEEDS_MASK_COLUMN, RECORD_ID_COLUMN]
+
+NEED_BITS = {need: 1 << bit for bit, need in enumerate(NEEDS_OPTIONS)}
+
+def create_empty_dataframe(columns=None):
+    return pd.DataFrame(columns=columns or STORED_COLUMNS)
+
+def split_needs(needs_str):
+    return [need.strip() for need in str(needs_str).split(',') if need.strip()]
+
+def encode_needs(needs):
+    mask = 0
+    for need in needs:
+        mask |= NEED_BITS.get(need, 0)
+    return mask
+
+def decode_needs(mask):
+    return [need for need, bit in NEED_BITS.items() if int(mask) & bit]
+
+def needs_masks(needs_strings):
+    codes, uniques = pd.factorize(needs_strings)
+    unique_masks = np.array([encode_needs(split_needs(value)) for value in uniques] + [0], dtype='int64')
+    return pd.Series(unique_masks[codes], index=needs_strings.index, dtype='int64')
+
+def fill_needs_mask(df):
+    if 'الاحتياجات_العاجلة' not in df.columns:
+        return df
+    if NEEDS_MASK_COLUMN in df.columns and not df[NEEDS_MASK_COLUMN].isna().any():
+        return df
+    df = df.copy()
+    masks = df[NEEDS_MASK_COLUMN] if NEEDS_MASK_COLUMN in df.columns else pd.Series(np.nan, index=df.index)
+    df[NEEDS_MASK_COLUMN] = masks.fillna(needs_masks(df['الاحتياجات_العاجلة'])).astype('int64')
+    return df
+
+def new_record_id():
+    return os.urandom(8).hex()
+
+def fill_record_ids(df):
+    if RECORD_ID_COLUMN in df.columns and not df[RECORD_ID_COLUMN].isna().any():
+        return df
+    df = df.copy()
+    ids = df[RECORD_ID_COLUMN].astype(object) if RECORD_ID_COLUMN in df.columns else pd.Series(None, index=df.index, dtype=object)
+    missing = ids.isna()
+    ids[missing] = [new_record_id() for _ in range(missing.sum())]
+    df[RECORD_ID_COLUMN] = ids
+    return df
+
+def fill_legacy_ids(df, prefix):
+    if RECORD_ID_COLUMN not in df.columns or not df[RECORD_ID_COLUMN].isna().any():
+        return df
+    ids = df[RECORD_ID_COLUMN].astype(object)
+    missing = ids.isna()
+    ids[missing] = prefix + df.index[missing].astype(str)
+    df[RECORD_ID_COLUMN] = ids
+    return df
+
+CATEGORY_COLUMNS = {
+    'الموقع_الجغرافي': LOCATIONS,
+    'نوع_الفقد': LOSS_TYPES,
+    'الاحتياجات_العاجلة': []
+}
+
+def to_category(values, vocabulary):
+    if not isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.astype('category')
+    return values.cat.set_categories(sorted(set(vocabulary) | set(values.cat.categories)))
+
+def parse_dates(values):
+    dates = pd.to_datetime(values, format="%Y-%m-%d %H:%M", errors='coerce')
+    failed = dates.isna() & values.notna()
+    if failed.any():
+        dates[failed] = pd.to_datetime(values[failed], format='mixed', errors='coerce')
+    return dates
+
+def apply_schema(df):
+    for column, vocabulary in CATEGORY_COLUMNS.items():
+        if column in df.columns:
+            df[column] = to_category(df[column], vocabulary)
+    for column in ['عدد_الأفراد', NEEDS_MASK_COLUMN]:
+        if column in df.columns:
+            df[column] = pd.to_numeric(df[column], errors='coerce', downcast='unsigned')
+    if 'التاريخ' in df.columns and not pd.api.types.is_datetime64_any_dtype(df['التاريخ']):
+        dates = parse_dates(df['التاريخ'])
+        # A date that does not parse would be written back empty, so its column stays as the stored text
+        if not (dates.isna() & df['التاريخ'].notna()).any():
+            df['التاريخ'] = dates
+    return df
+
+def date_values(values):
+    return values if pd.api.types.is_datetime64_any_dtype(values) else parse_dates(values)
+
+def align_dates(frames):
+    if 'التاريخ' not in frames[0].columns:
+        return frames
+    if len({pd.api.types.is_datetime64_any_dtype(df['التاريخ']) for df in frames}) > 1:
+        return [to_storage_frame(df) for df in frames]
+    return frames
+
+def concat_typed(df, extra):
+    extra = apply_schema(extra)
+    for column in CATEGORY_COLUMNS:
+        if column in df.columns:
+            categories = sorted(set(df[column].cat.categories) | set(extra[column].cat.categories))
+            df[column] = df[column].cat.set_categories(categories)
+            extra[column] = extra[column].cat.set_categories(categories)
+    return pd.concat(align_dates([df, extra]), ignore_index=True)
+
+def format_dates(dates):
+    if isinstance(dates.dtype, pd.DatetimeTZDtype):
+        return dates.dt.strftime("%Y-%m-%d %H:%M")
+    # datetime_as_string formats in C, strftime goes through one Timestamp per row
+    formatted = pd.Series(np.datetime_as_string(dates.to_numpy(), unit='m'), index=dates.index)
+    return formatted.str.replace('T', ' ', regex=False).where(dates.notna())
+
+def to_storage_frame(df):
+    if 'التاريخ' in df.columns and pd.api.types.is_datetime64_any_dtype(df['التاريخ']):
+        df = df.assign(**{'التاريخ': format_dates(df['التاريخ'])})
+    return df
+
+def to_records(df):
+    df = to_storage_frame(df).astype(object)
+    return df.where(df.notna(), None).itertuples(index=False, name=None)
+
+def schema_memory_report(raw_df):
+    typed_df = apply_schema(raw_df.copy())
+    return pd.DataFrame({
+        'dtype_before': raw_df.dtypes.astype(str),
+        'dtype_after': typed_df.dtypes.astype(str),
+        'bytes_before': raw_df.memory_usage(deep=True, index=False),
+        'bytes_after': typed_df.memory_usage(deep=True, index=False)
+    })
+
+def count_needs(masks):
+    values = masks.to_numpy(dtype='int64')
+    counts = {need: int(np.count_nonzero(values & bit)) for need, bit in NEED_BITS.items()}
+    return {need: count for need, count in counts.items() if count}
+
+EXPORT_CHUNK_ROWS = 50_000
+IMPORT_CHUNK_ROWS = 50_000
+
+def stat_token(stat):
+    return f"{stat.st_ino}:{stat.st_size}:{stat.st_mtime_ns}"
+
+def file_token(path):
+    try:
+        return stat_token(os.stat(path))
+    except FileNotFoundError:
+        return None
+
+@contextmanager
+def file_lock(path, shared=False):
+    with open(path, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def try_lock(f):
+    try:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+class Metrics:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.spans = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+    
+    def record(self, span, seconds):
+        with self._lock:
+            stats = self.spans.setdefault(span, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+    
+    def count(self, counter, amount, kind):
+        if self.enabled:
+            with self._lock:
+                self.counters[(counter, kind)] = self.counters.get((counter, kind), 0) + amount
+    
+    def snapshot(self):
+        with self._lock:
+            return {span: tuple(stats) for span, stats in self.spans.items()}, dict(self.counters)
+    
+    def reset(self):
+        with self._lock:
+            self.spans.clear()
+            self.counters.clear()
+    
+    def prometheus_text(self):
+        spans, counters = self.snapshot()
+        lines = []
+        for name, kind, position, help_text in [
+            ('families_span_calls_total', 'counter', 0, "Calls of each instrumented function"),
+            ('families_span_seconds_total', 'counter', 1, "Wall time spent in each instrumented function"),
+            ('families_span_seconds_max', 'gauge', 2, "Slowest single call of each instrumented function")
+        ]:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            lines += [f'{name}{{span="{span}"}} {stats[position]}' for span, stats in sorted(spans.items())]
+        for counter in sorted({counter for counter, _ in counters}):
+            lines += [f"# TYPE families_{counter}_total counter"]
+            lines += [
+                f'families_{counter}_total{{kind="{kind}"}} {amount}'
+                for (name, kind), amount in sorted(counters.items()) if name == counter
+            ]
+        return "\n".join(lines) + "\n"
+    
+    def write_prometheus(self, path):
+        path = Path(path)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_text(self.prometheus_text(), encoding='utf-8')
+        os.replace(tmp_path, path)
+
+metrics = Metrics(enabled=os.environ.get('FAMILIES_METRICS') == '1')
+
+def instrumented(func):
+    span = func.__qualname__
+    
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not metrics.enabled:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            metrics.record(span, time.perf_counter() - start)
+    return wrapper
+
+TOMBSTONE_KEY = 'deleted'
+
+class SegmentedStorage:
+    default_filename = None
+    segment_suffix = '.log'
+    paging_pushdown = False
+    on_compact = None
+    
+    def __init__(self, filename, compact_threshold=1024 * 1024):
+        self.filepath = Path(filename)
+        self.segment_path = self.filepath.with_suffix(self.segment_suffix)
+        self.lock_path = self.segment_path.with_suffix('.lock')
+        self.garbage_path = self.segment_path.with_suffix('.garbage')
+        self.generation_path = self.segment_path.with_suffix('.generation')
+        self.compact_threshold = compact_threshold
+    
+    def load(self, columns=None, location=None):
+        columns = columns or STORED_COLUMNS
+        records, replaced = self._read_segment()
+        read_columns = columns + [RECORD_ID_COLUMN] if replaced and RECORD_ID_COLUMN not in columns else columns
+        df = self._apply_segment(self._read_base(read_columns, location), columns, records, replaced)
+        if location is not None:
+            df = df[df['الموقع_الجغرافي'] == location]
+        return df
+    
+    def apply_segment(self, df, columns=None):
+        # df holds this base with an earlier state of the segment applied, like a snapshot keyed by snapshot_key()
+        records, replaced = self._read_segment()
+        return self._apply_segment(df, columns or STORED_COLUMNS, records, replaced)
+    
+    def _apply_segment(self, df, columns, records, replaced):
+        if replaced:
+            df = df.loc[~df[RECORD_ID_COLUMN].isin(replaced), columns].reset_index(drop=True)
+        df = apply_schema(fill_needs_mask(df) if NEEDS_MASK_COLUMN in columns else df)
+        if records:
+            df = concat_typed(df, pd.DataFrame(records).reindex(columns=df.columns))
+        return df
+    
+    def _read_base(self, columns, location):
+        try:
+            f = open(self.filepath, 'rb')
+        except FileNotFoundError:
+            return create_empty_dataframe(columns)
+        
+        with f:
+            df = self._read_base_file(f, columns, location).reindex(columns=columns)
+            metrics.count('rows_scanned', len(df), 'base')
+            return fill_legacy_ids(df, 'legacy-').reset_index(drop=True)
+    
+    def _read_base_file(self, f, columns, location):
+        raise NotImplementedError
+    
+    def _iter_base_file(self, f, columns, chunk_rows):
+        df = self._read_base_file(f, columns, None)
+        for start in range(0, len(df), chunk_rows):
+            yield df.iloc[start:start + chunk_rows]
+    
+    def _write_base_file(self, df, path):
+        raise NotImplementedError
+    
+    def _open_segment(self):
+        try:
+            return open(self.segment_path, 'rb')
+        except FileNotFoundError:
+            return None
+    
+    @instrumented
+    def _read_segment(self):
+        # Segment entries are applied as upserts: every id they tombstone or write is dropped from
+        # the base first, so a segment the base has already absorbed reads the same as a fresh one.
+        segment = self._open_segment()
+        if segment is None:
+            return [], set()
+        records = {}
+        removed = set()
+        with segment:
+            segment.readline()
+            for number, line in enumerate(segment):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if TOMBSTONE_KEY in entry:
+                    records.pop(entry[TOMBSTONE_KEY], None)
+                    removed.add(entry[TOMBSTONE_KEY])
+                else:
+                    records[entry.setdefault(RECORD_ID_COLUMN, f"legacy-log-{number}")] = entry
+                metrics.count('rows_scanned', 1, 'log')
+        return list(records.values()), removed | records.keys()
+    
+    def generation(self):
+        try:
+            return self.generation_path.read_text().strip() or None
+        except FileNotFoundError:
+            return None
+    
+    def _segment_header(self):
+        return (json.dumps({'generation': self.generation()}) + '\n').encode('utf-8')
+    
+    def version(self):
+        return file_token(self.filepath), file_token(self.segment_path)
+    
+    def snapshot_key(self):
+        return self.generation(), file_token(self.filepath)
+    
+    def snapshot_position(self):
+        try:
+            return self.segment_path.stat().st_size
+        except FileNotFoundError:
+            return 0
+    
+    @contextmanager
+    def snapshot_view(self):
+        # Loads take no lock: the log is read before the base and applied as upserts, so a load
+        # always holds one base plus at least the log up to the position read before it; callers
+        # re-check snapshot_key() afterwards to notice a compaction that replaced the base meanwhile
+        yield
+    
+    def garbage(self):
+        try:
+            return int(self.garbage_path.read_text())
+        except (FileNotFoundError, ValueError):
+            return 0
+    
+    def save(self, df):
+        with file_lock(self.lock_path):
+            self._write_base(df)
+    
+    @instrumented
+    def _write_base(self, df):
+        tmp_path = self.filepath.with_name(self.filepath.name + '.tmp')
+        df = fill_record_ids(fill_needs_mask(df)).reindex(columns=STORED_COLUMNS)
+        self._write_base_file(df, tmp_path)
+        with open(tmp_path, 'rb+') as f:
+            os.fsync(f.fileno())
+            metrics.count('bytes_serialized', f.seek(0, os.SEEK_END), 'base')
+        os.replace(tmp_path, self.filepath)
+        # A crash before the segment is unlinked leaves it for the new base to read again, which is harmless
+        tmp_path = self.generation_path.with_name(self.generation_path.name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            f.write(new_record_id())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.generation_path)
+        self.segment_path.unlink(missing_ok=True)
+        self.garbage_path.unlink(missing_ok=True)
+        return df
+    
+    def _compact(self):
+        df = self._write_base(self.load())
+        if self.on_compact is not None:
+            self.on_compact(df)
+    
+    def append(self, record):
+        self.append_batch([record])
+    
+    def append_batch(self, records):
+        lines = b"".join(
+            (json.dumps({RECORD_ID_COLUMN: new_record_id(), **record}, ensure_ascii=False) + '\n').encode('utf-8')
+            for record in records
+        )
+        with file_lock(self.lock_path):
+            if self._append_segment(lines) >= self.compact_threshold:
+                self._compact()
+    
+    def get(self, record_id):
+        records, replaced = self._read_segment()
+        if record_id in replaced:
+            # The log holds the record's latest version, or it was deleted
+            df = pd.DataFrame([record for record in records if record[RECORD_ID_COLUMN] == record_id])
+            return apply_schema(fill_needs_mask(df.reindex(columns=STORED_COLUMNS)))
+        try:
+            f = open(self.filepath, 'rb')
+        except FileNotFoundError:
+            return create_empty_dataframe(STORED_COLUMNS)
+        with f:
+            # Record ids are unique in the base, so the scan stops at the chunk holding the record
+            for chunk in self._iter_base_file(f, STORED_COLUMNS, EXPORT_CHUNK_ROWS):
+                metrics.count('rows_scanned', len(chunk), 'base')
+                chunk = fill_legacy_ids(chunk.reindex(columns=STORED_COLUMNS), 'legacy-')
+                found = chunk[chunk[RECORD_ID_COLUMN] == record_id]
+                if len(found):
+                    return apply_schema(fill_needs_mask(found))
+        return create_empty_dataframe(STORED_COLUMNS)
+    
+    def update(self, record):
+        self._write_versions([{TOMBSTONE_KEY: record[RECORD_ID_COLUMN]}, record])
+    
+    def delete(self, record_id):
+        self._write_versions([{TOMBSTONE_KEY: record_id}])
+    
+    def _write_versions(self, entries):
+        lines = b"".join((json.dumps(entry, ensure_ascii=False) + '\n').encode('utf-8') for entry in entries)
+        with file_lock(self.lock_path):
+            size = self._append_segment(lines)
+            self.garbage_path.write_text(str(self.garbage() + 1))
+            if size >= self.compact_threshold:
+                self._compact()
+    
+    def append_many(self, df):
+        with file_lock(self.lock_path):
+            self._write_base(concat_typed(self.load(), fill_needs_mask(df).reindex(columns=STORED_COLUMNS)))
+    
+    def _append_segment(self, line):
+        header = self._segment_header()
+        if self._segment_is_foreign(header):
+            # The segment was written on top of another base generation, for example a restored
+            # backup, so fold it in rather than mixing generations in one segment
+            self._compact()
+            header = self._segment_header()
+        
+        with open(self.segment_path, 'a+b') as f:
+            if f.tell() == 0:
+                f.write(header)
+            else:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+            metrics.count('bytes_serialized', len(line), 'log')
+            return f.tell()
+    
+    def _segment_is_foreign(self, header):
+        segment = self._open_segment()
+        if segment is None:
+            return False
+        with segment:
+            first_line = segment.readline()
+        return bool(first_line) and first_line != header
+    
+    def compact(self):
+        with file_lock(self.lock_path):
+            if self.segment_path.exists():
+                self._compact()
+    
+    def iter_chunks(self, columns=None, chunk_rows=EXPORT_CHUNK_ROWS):
+        columns = columns or STORED_COLUMNS
+        records, replaced = self._read_segment()
+        read_columns = columns + [RECORD_ID_COLUMN] if replaced and RECORD_ID_COLUMN not in columns else columns
+        try:
+            f = open(self.filepath, 'rb')
+        except FileNotFoundError:
+            pass
+        else:
+            with f:
+                for chunk in self._iter_base_file(f, read_columns, chunk_rows):
+                    metrics.count('rows_scanned', len(chunk), 'base')
+                    chunk = fill_legacy_ids(chunk.reindex(columns=read_columns), 'legacy-')
+                    if replaced:
+                        chunk = chunk.loc[~chunk[RECORD_ID_COLUMN].isin(replaced), columns]
+                    yield apply_schema(fill_needs_mask(chunk) if NEEDS_MASK_COLUMN in columns else chunk)
+        
+        for start in range(0, len(records), chunk_rows):
+            yield apply_schema(pd.DataFrame(records[start:start + chunk_rows]).reindex(columns=columns))
+    
+    def distinct(self, column):
+        return list(self.load(columns=[column])[column].dropna().unique())
+    
+    def query(self, columns=None, location=None, needs=None, sort_by=None, offset=0, limit=None):
+        columns = columns or STORED_COLUMNS
+        needed = list(columns)
+        for column, used in [('الموقع_الجغرافي', location is not None), (NEEDS_MASK_COLUMN, needs), (sort_by, sort_by)]:
+            if used and column not in needed:
+                needed.append(column)
+        df = self.load(columns=needed, location=location)
+        if needs:
+            df = df[(df[NEEDS_MASK_COLUMN].to_numpy(dtype='int64') & encode_needs(needs)) != 0]
+        if sort_by is not None:
+            df = df.sort_values(by=sort_by, ascending=False)
+        if limit is not None:
+            df = df.iloc[offset:offset + limit]
+        return df[columns]
+    
+    def count(self, location=None, needs=None):
+        return len(self.query(columns=['الموقع_الجغرافي'], location=location, needs=needs))
+
+class CsvStorage(SegmentedStorage):
+    default_filename = "families_data.csv"
+    
+    @instrumented
+    def _read_base_file(self, f, columns, location):
+        return pd.read_csv(
+            f,
+            encoding='utf-8-sig',
+            usecols=lambda column: column in columns,
+            dtype={column: 'category' for column in CATEGORY_COLUMNS if column in columns}
+        )
+    
+    def _iter_base_file(self, f, columns, chunk_rows):
+        with pd.read_csv(
+            f,
+            encoding='utf-8-sig',
+            usecols=lambda column: column in columns,
+            dtype={column: 'category' for column in CATEGORY_COLUMNS if column in columns},
+            chunksize=chunk_rows
+        ) as reader:
+            yield from reader
+    
+    def _write_base_file(self, df, path):
+        to_storage_frame(df).to_csv(path, index=False, encoding='utf-8-sig')
+
+class ParquetStorage(SegmentedStorage):
+    default_filename = "families_data.parquet"
+    segment_suffix = '.parquet.log'
+    row_group_size = 64 * 1024
+    
+    @instrumented
+    def _read_base_file(self, f, columns, location):
+        import pyarrow.parquet as pq
+        
+        available = set(pq.read_schema(f).names)
+        f.seek(0)
+        filters = [('الموقع_الجغرافي', '==', location)] if location is not None else None
+        df = pd.read_parquet(f, columns=[column for column in columns if column in available], filters=filters)
+        return df.sort_index()
+    
+    def _iter_base_file(self, f, columns, chunk_rows):
+        import pyarrow.parquet as pq
+        
+        # Batches stream in file order, grouped by location, instead of being sorted back into
+        # insertion order after reading the whole base
+        parquet = pq.ParquetFile(f)
+        available = set(parquet.schema_arrow.names)
+        columns = [column for column in columns if column in available]
+        for batch in parquet.iter_batches(batch_size=chunk_rows, columns=columns):
+            yield batch.to_pandas()
+    
+    def _write_base_file(self, df, path):
+        df = apply_schema(df.reset_index(drop=True))
+        df = df.sort_values('الموقع_الجغرافي', kind='stable')
+        df.to_parquet(path, index=True, row_group_size=self.row_group_size)
+
+class SqliteStorage:
+    default_filename = "families_data.db"
+    paging_pushdown = True
+    indexes = {
+        'idx_families_location': 'الموقع_الجغرافي',
+        'idx_families_loss_type': 'نوع_الفقد',
+        'idx_families_date': 'التاريخ'
+    }
+    
+    def __init__(self, filename):
+        self.filepath = Path(filename)
+        self._view = threading.local()
+        column_defs = ", ".join(
+            f'"{column}" INTEGER' if column in ('عدد_الأفراد', NEEDS_MASK_COLUMN) else f'"{column}" TEXT'
+            for column in STORED_COLUMNS
+        )
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"CREATE TABLE IF NOT EXISTS families (id INTEGER PRIMARY KEY, {column_defs})")
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(families)")}
+            if NEEDS_MASK_COLUMN not in existing:
+                self._add_needs_mask(conn)
+            if RECORD_ID_COLUMN not in existing:
+                conn.execute(f'ALTER TABLE families ADD COLUMN "{RECORD_ID_COLUMN}" TEXT')
+                conn.execute(f'UPDATE families SET "{RECORD_ID_COLUMN}" = lower(hex(randomblob(8)))')
+            for index_name, column in self.indexes.items():
+                conn.execute(f'CREATE INDEX IF NOT EXISTS {index_name} ON families ("{column}")')
+            conn.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS idx_families_record_id ON families ("{RECORD_ID_COLUMN}")')
+            conn.execute("CREATE TABLE IF NOT EXISTS family_changes (id INTEGER PRIMARY KEY CHECK (id = 0), count INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO family_changes VALUES (0, 0)")
+    
+    def _add_needs_mask(self, conn):
+        conn.execute(f'ALTER TABLE families ADD COLUMN "{NEEDS_MASK_COLUMN}" INTEGER')
+        df = pd.read_sql_query('SELECT id, "الاحتياجات_العاجلة" FROM families', conn)
+        conn.executemany(
+            f'UPDATE families SET "{NEEDS_MASK_COLUMN}" = ? WHERE id = ?',
+            zip(needs_masks(df['الاحتياجات_العاجلة']).tolist(), df['id'].tolist())
+        )
+    
+    @contextmanager
+    def _connect(self):
+        conn = getattr(self._view, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+        conn = sqlite3.connect(self.filepath, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+    
+    def version(self):
+        # The file stats move whenever a connection opens or checkpoints the WAL, even with no change
+        # to the rows, which would leave the stats file and caches of every open reader out of date
+        return os.stat(self.filepath).st_ino, self.snapshot_key()
+    
+    def _changed(self, conn):
+        conn.execute("UPDATE family_changes SET count = count + 1 WHERE id = 0")
+    
+    def snapshot_key(self):
+        # Rows change in place, so a snapshot only stands in for the exact change count it was taken at
+        with self._connect() as conn:
+            return conn.execute("SELECT count FROM family_changes WHERE id = 0").fetchone()[0]
+    
+    def snapshot_position(self):
+        return None
+    
+    def apply_segment(self, df, columns=None):
+        return df[columns or STORED_COLUMNS]
+    
+    @contextmanager
+    def snapshot_view(self):
+        # Reads in this thread share one deferred transaction, so the change count and the frame come
+        # from the same state; a WAL reader does not hold writers back
+        with self._connect() as conn:
+            conn.execute("BEGIN")
+            self._view.conn = conn
+            try:
+                yield
+            finally:
+                self._view.conn = None
+    
+    def _select(self, columns):
+        return ", ".join(f'"{column}"' for column in (columns or STORED_COLUMNS))
+    
+    def _rows(self, df):
+        return to_records(fill_record_ids(fill_needs_mask(df)).reindex(columns=STORED_COLUMNS))
+    
+    @instrumented
+    def load(self, columns=None):
+        with self._connect() as conn:
+            df = pd.read_sql_query(f"SELECT {self._select(columns)} FROM families ORDER BY id", conn)
+        metrics.count('rows_scanned', len(df), 'sqlite')
+        return apply_schema(df)
+    
+    def iter_chunks(self, columns=None, chunk_rows=EXPORT_CHUNK_ROWS):
+        with self._connect() as conn:
+            for chunk in pd.read_sql_query(
+                f"SELECT {self._select(columns)} FROM families ORDER BY id",
+                conn,
+                chunksize=chunk_rows
+            ):
+                metrics.count('rows_scanned', len(chunk), 'sqlite')
+                yield apply_schema(chunk)
+    
+    def _insert(self, conn, df):
+        placeholders = ", ".join("?" for _ in STORED_COLUMNS)
+        conn.executemany(
+            f"INSERT INTO families ({self._select(STORED_COLUMNS)}) VALUES ({placeholders})",
+            self._rows(df)
+        )
+        self._changed(conn)
+    
+    def save(self, df):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM families")
+            self._insert(conn, df)
+    
+    def append(self, record):
+        self.append_batch([record])
+    
+    def append_batch(self, records):
+        with self._connect() as conn:
+            self._insert(conn, pd.DataFrame(records))
+    
+    def append_many(self, df):
+        with self._connect() as conn:
+            self._insert(conn, df)
+    
+    def get(self, record_id):
+        with self._connect() as conn:
+            return apply_schema(pd.read_sql_query(
+                f'SELECT {self._select(None)} FROM families WHERE "{RECORD_ID_COLUMN}" = ?',
+                conn,
+                params=[record_id]
+            ))
+    
+    def update(self, record):
+        assignments = ", ".join(f'"{column}" = ?' for column in STORED_COLUMNS)
+        with self._connect() as conn:
+            conn.execute(
+                f'UPDATE families SET {assignments} WHERE "{RECORD_ID_COLUMN}" = ?',
+                (*next(self._rows(pd.DataFrame([record]))), record[RECORD_ID_COLUMN])
+            )
+            self._changed(conn)
+    
+    def delete(self, record_id):
+        with self._connect() as conn:
+            conn.execute(f'DELETE FROM families WHERE "{RECORD_ID_COLUMN}" = ?', (record_id,))
+            self._changed(conn)
+    
+    def garbage(self):
+        return 0
+    
+    def compact(self):
+        with self._connect() as conn:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    
+    def distinct(self, column):
+        with self._connect() as conn:
+            rows = conn.execute(
+                f'SELECT DISTINCT "{column}" FROM families WHERE "{column}" IS NOT NULL'
+            ).fetchall()
+        return [value for value, in rows]
+    
+    def _where(self, location, needs):
+        conditions = []
+        params = []
+        if location is not None:
+            conditions.append('"الموقع_الجغرافي" = ?')
+            params.append(location)
+        if needs:
+            conditions.append(f'("{NEEDS_MASK_COLUMN}" & ?) != 0')
+            params.append(encode_needs(needs))
+        return (" WHERE " + " AND ".join(conditions) if conditions else ""), params
+    
+    @instrumented
+    def query(self, columns=None, location=None, needs=None, sort_by=None, offset=0, limit=None):
+        where, params = self._where(location, needs)
+        sql = f"SELECT {self._select(columns)} FROM families{where}"
+        sql += f' ORDER BY "{sort_by}" DESC' if sort_by is not None else " ORDER BY id"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params += [limit, offset]
+        with self._connect() as conn:
+            df = pd.read_sql_query(sql, conn, params=params)
+        metrics.count('rows_scanned', len(df), 'sqlite')
+        return apply_schema(df)
+    
+    def count(self, location=None, needs=None):
+        where, params = self._where(location, needs)
+        with self._connect() as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM families{where}", params).fetchone()[0]
+
+STORAGE_BACKENDS = {
+    'csv': CsvStorage,
+    'sqlite': SqliteStorage,
+    'parquet': ParquetStorage
+}
+
+AGGREGATE_COLUMNS = ['التاريخ', 'عدد_الأفراد', 'نوع_الفقد', 'الاحتياجات_العاجلة', 'الموقع_الجغرافي', NEEDS_MASK_COLUMN]
+
+ROLLUP_DIMENSIONS = {'locations': 'الموقع_الجغرافي', 'loss_types': 'نوع_الفقد', 'needs': NEEDS_MASK_COLUMN}
+HOURLY_RETENTION_DAYS = 14
+
+def empty_aggregates():
+    return {
+        'families': 0,
+        'members': 0,
+        'locations': {},
+        'loss_types': {},
+        'needs': {},
+        'family_sizes': {},
+        'hourly': {},
+        'daily': {}
+    }
+
+def empty_bucket():
+    return {'families': 0, **{dimension: {} for dimension in ROLLUP_DIMENSIONS}}
+
+def merge_bucket(bucket, other):
+    bucket['families'] += other['families']
+    for dimension in ROLLUP_DIMENSIONS:
+        for value, count in other[dimension].items():
+            bucket[dimension][value] = bucket[dimension].get(value, 0) + count
+
+def fold_hourly(aggregates):
+    if not aggregates['hourly']:
+        return
+    latest_day = datetime.strptime(max(aggregates['hourly'])[:10], "%Y-%m-%d")
+    cutoff = (latest_day - timedelta(days=HOURLY_RETENTION_DAYS)).strftime("%Y-%m-%d")
+    for hour in [hour for hour in aggregates['hourly'] if hour[:10] <= cutoff]:
+        merge_bucket(aggregates['daily'].setdefault(hour[:10], empty_bucket()), aggregates['hourly'].pop(hour))
+
+def build_rollups(df):
+    dates = date_values(df['التاريخ'])
+    hours = dates.dt.floor('h')
+    valid = hours.notna().to_numpy()
+    df, hours = df[valid], hours[valid]
+    keys = {hour: hour.strftime("%Y-%m-%d %H") for hour in hours.unique()}
+    hourly = {key: empty_bucket() for key in keys.values()}
+    for hour, count in hours.value_counts().items():
+        hourly[keys[hour]]['families'] = int(count)
+    for dimension in ['locations', 'loss_types']:
+        counts = df.groupby([hours, df[ROLLUP_DIMENSIONS[dimension]]], observed=True).size()
+        for (hour, value), count in counts.items():
+            if count:
+                hourly[keys[hour]][dimension][str(value)] = int(count)
+    masks = df[NEEDS_MASK_COLUMN].to_numpy(dtype='int64')
+    for need, bit in NEED_BITS.items():
+        for hour, count in hours[(masks & bit) != 0].value_counts().items():
+            hourly[keys[hour]]['needs'][need] = int(count)
+    return hourly
+
+def hour_key(date):
+    # Like build_rollups, a record whose date is missing or does not parse has no rollup bucket
+    key = str(date)[:13]
+    try:
+        datetime.strptime(key, "%Y-%m-%d %H")
+    except ValueError:
+        hour = parse_dates(pd.Series([date], dtype=object)).dt.floor('h').iloc[0]
+        return None if pd.isna(hour) else hour.strftime("%Y-%m-%d %H")
+    return key
+
+def add_to_aggregates(aggregates, record):
+    members = int(record['عدد_الأفراد'])
+    aggregates['families'] += 1
+    aggregates['members'] += members
+    hour = hour_key(record['التاريخ'])
+    bucket = empty_bucket() if hour is None else aggregates['hourly'].setdefault(hour, empty_bucket())
+    bucket['families'] += 1
+    for key, value in [
+        ('locations', record['الموقع_الجغرافي']),
+        ('loss_types', record['نوع_الفقد']),
+        ('family_sizes', str(members))
+    ] + [('needs', need) for need in decode_needs(record[NEEDS_MASK_COLUMN])]:
+        aggregates[key][value] = aggregates[key].get(value, 0) + 1
+        if key in bucket:
+            bucket[key][value] = bucket[key].get(value, 0) + 1
+    fold_hourly(aggregates)
+
+def decrement(counts, value):
+    if value in counts:
+        counts[value] -= 1
+        if not counts[value]:
+            del counts[value]
+
+def remove_from_aggregates(aggregates, record):
+    members = int(record['عدد_الأفراد'])
+    aggregates['families'] -= 1
+    aggregates['members'] -= members
+    hour = hour_key(record['التاريخ'])
+    if hour is None:
+        period, buckets = None, {}
+    elif hour in aggregates['hourly']:
+        period, buckets = hour, aggregates['hourly']
+    else:
+        period, buckets = hour[:10], aggregates['daily']
+    bucket = buckets.get(period, empty_bucket())
+    bucket['families'] -= 1
+    for key, value in [
+        ('locations', record['الموقع_الجغرافي']),
+        ('loss_types', record['نوع_الفقد']),
+        ('family_sizes', str(members))
+    ] + [('needs', need) for need in decode_needs(record[NEEDS_MASK_COLUMN])]:
+        decrement(aggregates[key], value)
+        if key in bucket:
+            decrement(bucket[key], value)
+    if period in buckets and bucket['families'] <= 0:
+        del buckets[period]
+
+def build_aggregates(df):
+    df = fill_needs_mask(df)
+    aggregates = {
+        'families': len(df),
+        'members': int(df['عدد_الأفراد'].sum()),
+        'locations': {str(k): int(v) for k, v in df['الموقع_الجغرافي'].value_counts().items() if v},
+        'loss_types': {str(k): int(v) for k, v in df['نوع_الفقد'].value_counts().items() if v},
+        'needs': count_needs(df[NEEDS_MASK_COLUMN]),
+        'family_sizes': {str(int(k)): int(v) for k, v in df['عدد_الأفراد'].value_counts().items()}
+    }
+    aggregates['hourly'] = build_rollups(df) if 'التاريخ' in df.columns else {}
+    aggregates['daily'] = {}
+    fold_hourly(aggregates)
+    return aggregates
+
+def merge_aggregates(aggregates, other):
+    aggregates['families'] += other['families']
+    aggregates['members'] += other['members']
+    for key in ['locations', 'loss_types', 'needs', 'family_sizes']:
+        for value, count in other[key].items():
+            aggregates[key][value] = aggregates[key].get(value, 0) + count
+    for key in ['hourly', 'daily']:
+        for period, bucket in other[key].items():
+            merge_bucket(aggregates[key].setdefault(period, empty_bucket()), bucket)
+    fold_hourly(aggregates)
+
+def aggregate_counts(aggregates, key):
+    return pd.Series(aggregates[key], dtype='int64').sort_values(ascending=False)
+
+FAMILY_SIZE_BINS = 20
+
+def bin_counts(counts, bins):
+    if counts.empty:
+        return pd.Series(dtype='int64')
+    values = counts.index.astype(int).to_numpy()
+    low = values.min()
+    width = max(1, -(-(values.max() - low + 1) // bins))
+    positions = (values - low) // width
+    totals = np.bincount(positions, weights=counts.to_numpy(), minlength=positions.max() + 1).astype('int64')
+    starts = low + width * np.arange(len(totals))
+    labels = [str(start) if width == 1 else f"{start}-{start + width - 1}" for start in starts]
+    return pd.Series(totals, index=labels)
+
+ROLLUP_GRANULARITIES = ['hourly', 'daily', 'weekly']
+
+def week_start(key):
+    day = datetime.strptime(key[:10], "%Y-%m-%d")
+    return (day - timedelta(days=day.weekday())).strftime("%Y-%m-%d")
+
+def rollup_buckets(aggregates, granularity, start=None, end=None):
+    if granularity == 'hourly':
+        sources, period = [aggregates['hourly']], lambda key: key
+    elif granularity == 'daily':
+        sources, period = [aggregates['daily'], aggregates['hourly']], lambda key: key[:10]
+    else:
+        sources, period = [aggregates['daily'], aggregates['hourly']], week_start
+    buckets = {}
+    for source in sources:
+        for key, bucket in source.items():
+            if (start is None or key[:10] >= start) and (end is None or key[:10] <= end):
+                merge_bucket(buckets.setdefault(period(key), empty_bucket()), bucket)
+    return dict(sorted(buckets.items()))
+
+def comparable_aggregates(aggregates):
+    comparable = {key: value for key, value in aggregates.items() if key not in ('hourly', 'daily')}
+    comparable['daily'] = rollup_buckets(aggregates, 'daily')
+    return comparable
+
+def rollup_frame(aggregates, granularity, dimension=None, start=None, end=None):
+    buckets = rollup_buckets(aggregates, granularity, start, end)
+    if dimension is None:
+        return pd.Series({period: bucket['families'] for period, bucket in buckets.items()}, dtype='int64')
+    frame = pd.DataFrame.from_dict({period: bucket[dimension] for period, bucket in buckets.items()}, orient='index')
+    return frame.fillna(0).astype('int64')
+
+def summarize(aggregates):
+    families = aggregates['families']
+    return {
+        'families': families,
+        'members': aggregates['members'],
+        'avg_members': aggregates['members'] / families if families else 0.0,
+        'locations': len(aggregates['locations'])
+    }
+
+def dashboard_report(aggregates):
+    return {
+        'summary': summarize(aggregates),
+        'locations': aggregate_counts(aggregates, 'locations'),
+        'loss_types': aggregate_counts(aggregates, 'loss_types'),
+        'needs': aggregate_counts(aggregates, 'needs'),
+        'family_sizes': aggregate_counts(aggregates, 'family_sizes'),
+        'family_size_bins': bin_counts(aggregate_counts(aggregates, 'family_sizes'), FAMILY_SIZE_BINS)
+    }
+
+AGGREGATE_DELTA_LIMIT = 1024 * 1024
+DELTA_COLUMNS = ['التاريخ', 'عدد_الأفراد', 'نوع_الفقد', 'الموقع_الجغرافي', NEEDS_MASK_COLUMN]
+
+def read_last_line(f, block_size=64 * 1024):
+    position = f.seek(0, os.SEEK_END)
+    data = b''
+    while position > 0 and data.count(b'\n') < 2:
+        step = min(block_size, position)
+        position -= step
+        f.seek(position)
+        data = f.read(step) + data
+    return data.rstrip(b'\n').rsplit(b'\n', 1)[-1]
+
+class AggregateStore:
+    # The stats file holds the aggregates at one data version and the delta log beside it the
+    # records each later write added and removed, so a write appends a line instead of rewriting
+    # rollups that grow with the registry's age. Every line also carries the data version and
+    # family count after it, which writers read from the last line. The log is removed before the
+    # stats file is replaced and started again after, so it always belongs to the file beside it.
+    def __init__(self, path, delta_limit=AGGREGATE_DELTA_LIMIT):
+        self.path = Path(path)
+        self.lock_path = self.path.with_suffix('.lock')
+        self.delta_path = self.path.with_suffix('.delta')
+        self.delta_limit = delta_limit
+    
+    @instrumented
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                aggregates = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if aggregates.keys() >= empty_aggregates().keys():
+            for entry in self._read_delta():
+                for record in entry['removed']:
+                    remove_from_aggregates(aggregates, record)
+                for record in entry['added']:
+                    add_to_aggregates(aggregates, record)
+                aggregates['data_version'] = entry['data_version']
+        return aggregates
+    
+    def _read_delta(self):
+        try:
+            with open(self.delta_path, 'rb') as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A torn last line leaves the data version behind the storage, which forces a rebuild
+                return
+            metrics.count('rows_scanned', len(entry['added']) + len(entry['removed']), 'aggregates')
+            yield entry
+    
+    def tail(self):
+        try:
+            with open(self.delta_path, 'rb') as f:
+                return json.loads(read_last_line(f))
+        except FileNotFoundError:
+            aggregates = self.load()
+            if aggregates is None or not aggregates.keys() >= empty_aggregates().keys():
+                return None
+            return {'data_version': aggregates.get('data_version'), 'families': aggregates['families']}
+        except ValueError:
+            return None
+    
+    @instrumented
+    def save(self, aggregates, data_version):
+        aggregates = dict(aggregates, data_version=list(data_version))
+        self.delta_path.unlink(missing_ok=True)
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        text = json.dumps(aggregates, ensure_ascii=False)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        metrics.count('bytes_serialized', len(text.encode('utf-8')), 'aggregates')
+        os.replace(tmp_path, self.path)
+        self._append_delta({'data_version': aggregates['data_version'], 'families': aggregates['families'],
+                            'added': [], 'removed': []})
+    
+    @instrumented
+    def append(self, tail, added, removed, data_version):
+        entry = {
+            'data_version': list(data_version),
+            'families': tail['families'] + len(added) - len(removed),
+            'added': [{column: record.get(column) for column in DELTA_COLUMNS} for record in added],
+            'removed': [{column: record.get(column) for column in DELTA_COLUMNS} for record in removed]
+        }
+        if self._append_delta(entry) >= self.delta_limit:
+            self.save(self.load(), data_version)
+        return entry
+    
+    def _append_delta(self, entry):
+        line = (json.dumps(entry, ensure_ascii=False) + '\n').encode('utf-8')
+        with open(self.delta_path, 'ab') as f:
+            f.write(line)
+            metrics.count('bytes_serialized', len(line), 'aggregates')
+            return f.tell()
+
+SNAPSHOT_RETENTION = 7
+SNAPSHOT_INTERVAL = timedelta(hours=1)
+SNAPSHOT_RETRY_DELAY = timedelta(minutes=1)
+SNAPSHOT_READ_ATTEMPTS = 3
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def version_key(version):
+    return json.loads(json.dumps(version))
+
+class SnapshotStore:
+    # zstd-compressed Parquet copies of the registry, listed newest last in manifest.json with
+    # their checksum, the storage key they can be brought up to date from and how far into the
+    # storage's log they were taken.
+    def __init__(self, directory, retention=SNAPSHOT_RETENTION):
+        self.directory = Path(directory)
+        self.manifest_path = self.directory / 'manifest.json'
+        self.lock_path = self.directory / 'manifest.lock'
+        self.retention = retention
+        self._verified = set()
+        self._corrupt = set()
+    
+    def entries(self):
+        try:
+            with open(self.manifest_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return []
+    
+    def _write_entries(self, entries):
+        tmp_path = self.manifest_path.with_name(self.manifest_path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+    
+    def latest(self):
+        entries = self.entries()
+        return entries[-1] if entries else None
+    
+    def find(self, name=None):
+        for entry in reversed(self.entries()):
+            if name is None or entry['name'] == name:
+                return entry
+        return None
+    
+    def current(self, storage_key, position):
+        entry = self.for_key(storage_key)
+        return entry if entry is not None and entry['position'] == position else None
+    
+    def for_key(self, storage_key):
+        storage_key = version_key(storage_key)
+        for entry in reversed(self.entries()):
+            if entry.get('storage_key') == storage_key and entry['name'] not in self._corrupt:
+                return entry
+        return None
+    
+    @instrumented
+    def write(self, df, storage_key, position):
+        self.directory.mkdir(exist_ok=True)
+        created = datetime.now()
+        path = self.directory / f"snapshot-{created:%Y%m%dT%H%M%S%f}.parquet"
+        tmp_path = path.with_name(path.name + '.tmp')
+        df.reset_index(drop=True).to_parquet(tmp_path, compression='zstd', index=False)
+        with open(tmp_path, 'rb+') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        entry = {
+            'name': path.name,
+            'created': created.isoformat(timespec='seconds'),
+            'rows': len(df),
+            'bytes': path.stat().st_size,
+            'sha256': file_sha256(path),
+            'storage_key': version_key(storage_key),
+            'position': position
+        }
+        self._verified.add(path.name)
+        metrics.count('bytes_serialized', entry['bytes'], 'snapshot')
+        
+        with file_lock(self.lock_path):
+            entries = self.entries() + [entry]
+            self._write_entries(entries[-self.retention:])
+        for evicted in entries[:-self.retention]:
+            (self.directory / evicted['name']).unlink(missing_ok=True)
+        return entry
+    
+    def retag(self, entry, storage_key, position):
+        with file_lock(self.lock_path):
+            entries = self.entries()
+            for stored in entries:
+                if stored['name'] == entry['name']:
+                    stored['storage_key'] = version_key(storage_key)
+                    stored['position'] = position
+            self._write_entries(entries)
+    
+    @instrumented
+    def read(self, entry, columns=None):
+        path = self.directory / entry['name']
+        if entry['name'] not in self._verified:
+            if file_sha256(path) != entry['sha256']:
+                self._corrupt.add(entry['name'])
+                raise ValueError(f"snapshot {entry['name']} does not match its checksum")
+            self._verified.add(entry['name'])
+        df = pd.read_parquet(path, columns=columns)
+        metrics.count('rows_scanned', len(df), 'snapshot')
+        return apply_schema(df)
+
+ARABIC_NORMALIZATION = str.maketrans({
+    **{chr(c): None for c in range(0x064B, 0x0653)},
+    '\u0670': None,
+    '\u0640': None,
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ئ': 'ي', 'ؤ': 'و', 'ة': 'ه',
+    **{chr(0x0660 + d): str(d) for d in range(10)},
+    **{chr(0x06F0 + d): str(d) for d in range(10)}
+})
+
+TOKEN_PATTERN = re.compile(r'[\w\u064B-\u0652\u0670]+')
+
+TEXT_COLUMNS = ['اسم_العائلة', 'ملاحظات']
+
+def normalize_arabic(text):
+    return str(text).translate(ARABIC_NORMALIZATION).lower()
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(normalize_arabic(text))
+
+def pack_bits(mask):
+    return np.packbits(mask, bitorder='little')
+
+class TextIndex:
+    def __init__(self, values):
+        codes, uniques = pd.factorize(values)
+        self.codes = codes.astype('int32')
+        self.value_count = len(uniques)
+        pairs = pd.Series(np.asarray(uniques, dtype=object)).str.findall(TOKEN_PATTERN).explode().dropna()
+        raw_codes, raw_tokens = pd.factorize(pairs.to_numpy(dtype=object))
+        normalized_codes, vocabulary = pd.factorize(
+            np.array([normalize_arabic(token) for token in raw_tokens], dtype=object),
+            sort=True
+        )
+        token_codes = normalized_codes[raw_codes]
+        unique_pairs = ~pd.MultiIndex.from_arrays([pairs.index, token_codes]).duplicated()
+        pairs, token_codes = pairs[unique_pairs], token_codes[unique_pairs]
+        order = np.argsort(token_codes, kind='stable')
+        self.vocabulary = list(vocabulary)
+        self.offsets = np.searchsorted(token_codes[order], np.arange(len(vocabulary) + 1))
+        self.postings = pairs.index.to_numpy(dtype='int32')[order]
+        self.extra_postings = defaultdict(list)
+    
+    def add_many(self, values):
+        value_ids = np.arange(self.value_count, self.value_count + len(values), dtype='int32')
+        self.value_count += len(values)
+        self.codes = np.concatenate([self.codes, value_ids])
+        for value_id, value in zip(value_ids.tolist(), values):
+            for token in set(tokenize(value)):
+                self.extra_postings[token].append(value_id)
+    
+    def match(self, prefix):
+        low = bisect.bisect_left(self.vocabulary, prefix)
+        high = bisect.bisect_left(self.vocabulary, prefix + '\uffff')
+        value_ids = [self.postings[self.offsets[low]:self.offsets[high]]] + [
+            np.asarray(ids, dtype='int32')
+            for token, ids in self.extra_postings.items()
+            if token.startswith(prefix)
+        ]
+        return np.isin(self.codes, np.concatenate(value_ids))
+
+class RegistryIndex:
+    facet_columns = ['الموقع_الجغرافي', 'نوع_الفقد', 'الاحتياجات_العاجلة']
+    
+    def __init__(self, df):
+        self._df = fill_needs_mask(df).reset_index(drop=True)
+        self._pending = []
+        self.size = len(self.df)
+        self.bitmaps = {}
+        for column in self.facet_columns[:2]:
+            codes = self.df[column].cat.codes.to_numpy()
+            for code, value in enumerate(self.df[column].cat.categories):
+                self.bitmaps[(column, value)] = pack_bits(codes == code)
+        masks = self.df[NEEDS_MASK_COLUMN].to_numpy(dtype='int64')
+        for need, bit in NEED_BITS.items():
+            self.bitmaps[('الاحتياجات_العاجلة', need)] = pack_bits((masks & bit) != 0)
+        self.members = self.df['عدد_الأفراد'].to_numpy(dtype='int64')
+        self.dates = date_values(self.df['التاريخ']).to_numpy(dtype='datetime64[ns]')
+        self.text = {column: TextIndex(self.df[column]) for column in TEXT_COLUMNS}
+        self.rows = dict(zip(self.df[RECORD_ID_COLUMN], range(self.size)))
+        self.removed = np.zeros(self.size, dtype=bool)
+        self._duplicates = None
+    
+    @property
+    def df(self):
+        # Added records wait here and are concatenated onto the frame once, when rows are next read
+        if self._pending:
+            self._df = concat_typed(self._df, pd.DataFrame(self._pending).reindex(columns=self._df.columns))
+            self._pending = []
+        return self._df
+    
+    @property
+    def duplicates(self):
+        if self._duplicates is None:
+            self._duplicates = DuplicateIndex(self.df)
+            self._duplicates.removed.update(np.flatnonzero(self.removed).tolist())
+        return self._duplicates
+    
+    def record(self, record_id):
+        row = self.rows.get(record_id)
+        return None if row is None else self.df.iloc[row]
+    
+    def remove(self, record_id):
+        row = self.rows.pop(record_id)
+        self.removed[row] = True
+        if self._duplicates is not None:
+            self._duplicates.removed.add(row)
+    
+    def add(self, record):
+        self.add_many([record])
+    
+    def add_many(self, records):
+        start = self.size
+        self.size += len(records)
+        length = (self.size + 7) // 8
+        for key, bitmap in self.bitmaps.items():
+            if len(bitmap) < length:
+                self.bitmaps[key] = np.concatenate([bitmap, np.zeros(length - len(bitmap), dtype=np.uint8)])
+        for row, record in enumerate(records, start):
+            keys = [
+                ('الموقع_الجغرافي', record['الموقع_الجغرافي']),
+                ('نوع_الفقد', record['نوع_الفقد'])
+            ] + [('الاحتياجات_العاجلة', need) for need in decode_needs(record[NEEDS_MASK_COLUMN])]
+            for key in keys:
+                if key not in self.bitmaps:
+                    self.bitmaps[key] = np.zeros(length, dtype=np.uint8)
+                self.bitmaps[key][row >> 3] |= np.uint8(1 << (row & 7))
+            self.rows[record[RECORD_ID_COLUMN]] = row
+            if self._duplicates is not None:
+                self._duplicates.add(record)
+        
+        members = np.array([int(record['عدد_الأفراد']) for record in records], dtype='int64')
+        self.members = np.concatenate([self.members, members])
+        dates = parse_dates(pd.Series([record['التاريخ'] for record in records], dtype=object))
+        self.dates = np.concatenate([self.dates, dates.to_numpy(dtype='datetime64[ns]')])
+        for column, index in self.text.items():
+            index.add_many([record[column] for record in records])
+        self.removed = np.concatenate([self.removed, np.zeros(len(records), dtype=bool)])
+        self._pending.extend(records)
+    
+    def _union(self, column, values):
+        bitmap = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+        for value in values:
+            if (column, value) in self.bitmaps:
+                bitmap |= self.bitmaps[(column, value)]
+        return bitmap
+    
+    def search(self, locations=None, loss_types=None, needs=None, members=None, dates=None, text=None):
+        bitmaps = [
+            self._union(column, values)
+            for column, values in zip(self.facet_columns, [locations, loss_types, needs])
+            if values
+        ]
+        if members is not None:
+            bitmaps.append(pack_bits((self.members >= members[0]) & (self.members <= members[1])))
+        if dates is not None:
+            start = np.datetime64(pd.Timestamp(dates[0]))
+            end = np.datetime64(pd.Timestamp(dates[1]) + pd.Timedelta(days=1))
+            bitmaps.append(pack_bits((self.dates >= start) & (self.dates < end)))
+        for token in tokenize(text or ''):
+            bitmaps.append(pack_bits(np.logical_or.reduce([index.match(token) for index in self.text.values()])))
+        
+        if not bitmaps:
+            return np.flatnonzero(~self.removed)
+        rows = np.flatnonzero(np.unpackbits(np.bitwise_and.reduce(bitmaps), count=self.size, bitorder='little'))
+        return rows[~self.removed[rows]]
+
+NAME_STOPWORDS = {'عايله', 'اسره'}
+
+DUPLICATE_WINDOW = 4
+DUPLICATE_THRESHOLD = 0.85
+SIGNATURE_BITS = 256
+SIGNATURE_THRESHOLD = 0.8
+
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def name_key(name):
+    tokens = [token for token in tokenize(name) if token not in NAME_STOPWORDS]
+    return " ".join(sorted(token[2:] if token.startswith('ال') and len(token) > 4 else token for token in tokens))
+
+def contact_key(contact):
+    digits = re.sub(r'\D', '', normalize_arabic(contact))
+    return digits[-9:] if len(digits) >= 7 else None
+
+@functools.lru_cache(maxsize=64 * 1024)
+def token_similarity(first, second):
+    if first == second:
+        return 1.0
+    return difflib.SequenceMatcher(None, first, second).ratio()
+
+def name_similarity(first, second):
+    first, second = first.split(), second.split()
+    if not first or len(first) != len(second):
+        return 0.0
+    return min(max(token_similarity(token, other) for other in second) for token in first)
+
+def name_signature(key):
+    signature = 0
+    for first, second in zip(key, key[1:]):
+        signature |= 1 << ((ord(first) * 31 + ord(second)) % SIGNATURE_BITS)
+    return [(signature >> shift) & 0xFFFFFFFFFFFFFFFF for shift in range(0, SIGNATURE_BITS, 64)]
+
+def popcount(signatures):
+    return POPCOUNT[np.ascontiguousarray(signatures).view(np.uint8)].sum(axis=1)
+
+def keyed_values(values, key_func):
+    codes, uniques = pd.factorize(values.astype(object))
+    return np.array([key_func(value) for value in uniques] + [None], dtype=object)[codes]
+
+class DuplicateIndex:
+    passes = {'forward': lambda key: key, 'reversed': lambda key: key[::-1]}
+    
+    def __init__(self, df):
+        df = df.reset_index(drop=True)
+        self.names = list(keyed_values(df['اسم_العائلة'], name_key))
+        self.locations = df['الموقع_الجغرافي'].astype(object).fillna('').tolist()
+        contacts = pd.Series(keyed_values(df['رقم_التواصل'], contact_key))
+        self.contacts = defaultdict(list, {
+            key: rows.tolist() for key, rows in contacts.groupby(contacts, sort=False).indices.items()
+        })
+        frame = pd.DataFrame({'location': self.locations, 'forward': self.names}, dtype=object).fillna('')
+        frame['reversed'] = frame['forward'].str[::-1]
+        self.sorted_rows = {
+            name: frame.sort_values(['location', name], kind='stable').index.to_numpy(dtype='int64')
+            for name in self.passes
+        }
+        self.removed = set()
+    
+    def _sort_key(self, transform):
+        return lambda row: (self.locations[row], transform(self.names[row] or ''))
+    
+    def add(self, record):
+        row = len(self.names)
+        key = name_key(record['اسم_العائلة'])
+        location = str(record['الموقع_الجغرافي'])
+        self.names.append(key)
+        self.locations.append(location)
+        contact = contact_key(record['رقم_التواصل'])
+        if contact:
+            self.contacts[contact].append(row)
+        for name, transform in self.passes.items():
+            rows = self.sorted_rows[name]
+            position = bisect.bisect_right(rows, (location, transform(key)), key=self._sort_key(transform))
+            self.sorted_rows[name] = np.insert(rows, position, row)
+    
+    def candidates(self, record, window=DUPLICATE_WINDOW, threshold=DUPLICATE_THRESHOLD):
+        key = name_key(record['اسم_العائلة'])
+        location = str(record['الموقع_الجغرافي'])
+        matches = {}
+        contact = contact_key(record.get('رقم_التواصل', ''))
+        if contact:
+            for row in self.contacts.get(contact, []):
+                if row not in self.removed:
+                    matches[row] = 1.0
+        if not key:
+            return matches
+        
+        for name, transform in self.passes.items():
+            rows = self.sorted_rows[name]
+            position = bisect.bisect_left(rows, (location, transform(key)), key=self._sort_key(transform))
+            for row in rows[max(0, position - window):position + window]:
+                if self.locations[row] == location and self.names[row] and row not in self.removed:
+                    score = name_similarity(key, self.names[row])
+                    if score >= threshold:
+                        matches[int(row)] = max(matches.get(int(row), 0.0), score)
+        return matches
+    
+    def duplicate_pairs(self, window=DUPLICATE_WINDOW, threshold=DUPLICATE_THRESHOLD):
+        names = np.array(self.names, dtype=object)
+        locations = np.array(self.locations, dtype=object)
+        codes, uniques = pd.factorize(names)
+        signatures = np.array(
+            [name_signature(key) for key in uniques] + [name_signature('')],
+            dtype=np.uint64
+        )[codes]
+        lengths = np.array([len(key) for key in uniques] + [0])[codes]
+        bit_counts = popcount(signatures)
+        
+        pairs = {}
+        for rows in self.sorted_rows.values():
+            for offset in range(1, window + 1):
+                first, second = rows[:-offset], rows[offset:]
+                shared = popcount(signatures[first] & signatures[second])
+                candidates = (
+                    (locations[first] == locations[second])
+                    & (lengths[first] > 0)
+                    & (lengths[second] > 0)
+                    & (2 * shared >= SIGNATURE_THRESHOLD * (bit_counts[first] + bit_counts[second]))
+                )
+                for a, b in zip(first[candidates].tolist(), second[candidates].tolist()):
+                    pair = (min(a, b), max(a, b))
+                    if pair not in pairs:
+                        score = name_similarity(names[a], names[b])
+                        if score >= threshold:
+                            pairs[pair] = score
+        for rows in self.contacts.values():
+            for a, b in zip(rows, rows[1:]):
+                pairs[(a, b)] = max(pairs.get((a, b), 0.0), DUPLICATE_THRESHOLD)
+        return pd.DataFrame(
+            [(first, second, score) for (first, second), score in pairs.items()],
+            columns=['first', 'second', 'score']
+        )
+
+def duplicate_rows(pairs):
+    parent = {}
+    
+    def find(row):
+        while parent.get(row, row) != row:
+            row = parent[row]
+        return row
+    
+    for first, second in zip(pairs['first'], pairs['second']):
+        first, second = find(first), find(second)
+        if first != second:
+            parent[max(first, second)] = min(first, second)
+    return {row: find(row) for row in parent}
+
+def removable_pairs(df, pairs):
+    # A similar name alone never removes a registration: the rows must also share a location and a
+    # contact number, or have no contact on either side and agree on family size and loss type
+    first = pairs['first'].to_numpy(dtype='int64')
+    second = pairs['second'].to_numpy(dtype='int64')
+    contacts = keyed_values(df['رقم_التواصل'], contact_key)
+    locations = df['الموقع_الجغرافي'].astype(object).to_numpy()
+    members = df['عدد_الأفراد'].to_numpy(dtype='float64')
+    loss_types = df['نوع_الفقد'].astype(object).to_numpy()
+    same_contact = pd.notna(contacts[first]) & (contacts[first] == contacts[second])
+    no_contact = pd.isna(contacts[first]) & pd.isna(contacts[second])
+    same_details = (members[first] == members[second]) & (loss_types[first] == loss_types[second])
+    return (locations[first] == locations[second]) & (same_contact | (no_contact & same_details))
+
+def write_csv_export(chunks, f):
+    f.write('\ufeff'.encode('utf-8'))
+    for i, chunk in enumerate(chunks):
+        f.write(to_storage_frame(chunk).to_csv(index=False, header=i == 0).encode('utf-8'))
+
+def write_excel_export(chunks, f):
+    try:
+        import xlsxwriter
+    except ImportError:
+        xlsxwriter = None
+    
+    if xlsxwriter is not None:
+        workbook = xlsxwriter.Workbook(f, {'constant_memory': True})
+        worksheet = workbook.add_worksheet('العائلات')
+        row = 0
+        for chunk in chunks:
+            if row == 0:
+                worksheet.write_row(0, 0, list(chunk.columns))
+                row = 1
+            for record in to_records(chunk):
+                worksheet.write_row(row, 0, record)
+                row += 1
+        workbook.close()
+        return
+    
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet('العائلات')
+    header_written = False
+    for chunk in chunks:
+        if not header_written:
+            worksheet.append(list(chunk.columns))
+            header_written = True
+        for record in to_records(chunk):
+            worksheet.append(record)
+    workbook.save(f)
+
+def write_json_export(chunks, f):
+    f.write(b'[')
+    separator = b''
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        records = to_storage_frame(chunk).to_json(orient='records', force_ascii=False)
+        f.write(separator + records[1:-1].encode('utf-8'))
+        separator = b','
+    f.write(b']')
+
+def reported_chunks(chunks, progress):
+    for chunk in chunks:
+        yield chunk
+        progress(len(chunk))
+
+def read_import_chunks(f, name, chunk_rows=IMPORT_CHUNK_ROWS):
+    if str(name).lower().endswith(('.xlsx', '.xlsm')):
+        from openpyxl import load_workbook
+        workbook = load_workbook(f, read_only=True, data_only=True)
+        try:
+            rows = workbook.worksheets[0].iter_rows(values_only=True)
+            header = [str(column).strip() if column is not None else "" for column in next(rows, ())]
+            start = 0
+            while True:
+                chunk = [row for _, row in zip(range(chunk_rows), rows)]
+                if not chunk:
+                    break
+                yield pd.DataFrame(chunk, columns=header, index=range(start, start + len(chunk)), dtype=object)
+                start += len(chunk)
+        finally:
+            workbook.close()
+        return
+    
+    with pd.read_csv(f, encoding='utf-8-sig', dtype=str, keep_default_na=False, chunksize=chunk_rows) as reader:
+        for chunk in reader:
+            yield chunk.rename(columns=str.strip)
+
+def import_text(values):
+    return values.astype(object).where(values.notna(), "").astype(str).str.strip()
+
+def validate_families(chunk):
+    df = chunk.reindex(columns=COLUMNS)
+    names = import_text(df['اسم_العائلة'])
+    loss_types = import_text(df['نوع_الفقد'])
+    locations = import_text(df['الموقع_الجغرافي'])
+    members = pd.to_numeric(import_text(df['عدد_الأفراد']), errors='coerce')
+    codes, uniques = pd.factorize(import_text(df['الاحتياجات_العاجلة']))
+    unique_needs = [split_needs(value) for value in uniques] + [[]]
+    needs = pd.Series([", ".join(unique_needs[code]) for code in codes], index=df.index)
+    unknown_needs = np.array([any(need not in NEED_BITS for need in value) for value in unique_needs])[codes]
+    
+    reasons = pd.Series("", index=df.index)
+    for failed, reason in [
+        (names == "", "اسم العائلة مفقود"),
+        (~members.between(1, 50) | (members % 1 != 0), "عدد الأفراد يجب أن يكون بين 1 و 50"),
+        (~loss_types.isin(LOSS_TYPES), "نوع الفقد غير صالح"),
+        (needs == "", "الاحتياجات العاجلة مفقودة"),
+        (unknown_needs, "احتياجات غير معروفة"),
+        (~locations.isin(LOCATIONS), "الموقع الجغرافي غير صالح")
+    ]:
+        reasons[failed] += reason + "؛ "
+    rejected = reasons != ""
+    
+    notes = import_text(df['ملاحظات'])
+    contacts = import_text(df['رقم_التواصل'])
+    dates = parse_dates(import_text(df['التاريخ']).replace("", None))
+    accepted = pd.DataFrame({
+        'التاريخ': dates.fillna(pd.Timestamp(datetime.now().strftime("%Y-%m-%d %H:%M"))),
+        'اسم_العائلة': names,
+        'عدد_الأفراد': members,
+        'نوع_الفقد': loss_types,
+        'الاحتياجات_العاجلة': needs,
+        'الموقع_الجغرافي': locations,
+        'ملاحظات': notes.where(notes != "", "لا توجد ملاحظات"),
+        'رقم_التواصل': contacts.where(contacts != "", "غير متوفر")
+    })[~rejected]
+    rejects = chunk[rejected].assign(**{
+        'رقم_الصف': chunk.index[rejected.to_numpy()] + 2,
+        'سبب_الرفض': reasons[rejected].str.rstrip("؛ ")
+    })
+    return accepted.astype({'عدد_الأفراد': 'int64'}), rejects
+
+def validate_import(f, name, chunk_rows=IMPORT_CHUNK_ROWS):
+    accepted = []
+    rejected = []
+    for chunk in read_import_chunks(f, name, chunk_rows):
+        valid, rejects = validate_families(chunk)
+        accepted.append(valid)
+        rejected.append(rejects)
+    accepted = pd.concat(accepted, ignore_index=True) if accepted else create_empty_dataframe(COLUMNS)
+    rejected = pd.concat(rejected) if rejected else pd.DataFrame(columns=['رقم_الصف', 'سبب_الرفض'])
+    return accepted, rejected
+
+def excel_export_available():
+    return any(importlib.util.find_spec(module) is not None for module in ('xlsxwriter', 'openpyxl'))
+
+EXPORT_FORMATS = {
+    'csv': {'writer': write_csv_export, 'extension': 'csv', 'mime': "text/csv"},
+    'xlsx': {
+        'writer': write_excel_export,
+        'extension': 'xlsx',
+        'mime': "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    },
+    'json': {'writer': write_json_export, 'extension': 'json', 'mime': "application/json"}
+}
+
+EXPORT_WORKERS = 2
+EXPORT_PROGRESS_ROWS = 10_000
+
+class ExportJob:
+    def __init__(self, export_format, version, path, rows_total):
+        self.export_format = export_format
+        self.version = version
+        self.path = path
+        self.rows_total = rows_total
+        self.rows_done = 0
+        self.error = None
+        self.future = None
+    
+    def advance(self, rows):
+        self.rows_done += rows
+    
+    @property
+    def done(self):
+        return self.future is not None and self.future.done()
+    
+    @property
+    def progress(self):
+        return 1.0 if self.done else min(self.rows_done / max(self.rows_total, 1), 1.0)
+
+class ExportJobs:
+    # Builds exports on a worker pool into files keyed by format and data version, so every
+    # session asking for the same export shares one job and later downloads reuse the file.
+    def __init__(self, data_manager, directory, workers=EXPORT_WORKERS):
+        self.data_manager = data_manager
+        self.directory = Path(directory)
+        self.workers = workers
+        self._jobs = {}
+        self._pool = None
+        self._lock = threading.Lock()
+    
+    def artifact_path(self, export_format, version):
+        key = hashlib.sha1(json.dumps(version).encode('utf-8')).hexdigest()[:16]
+        return self.directory / f"families_data_{key}.{EXPORT_FORMATS[export_format]['extension']}"
+    
+    def artifact(self, export_format):
+        path = self.artifact_path(export_format, self.data_manager.version())
+        return path if path.exists() else None
+    
+    def job(self, export_format):
+        with self._lock:
+            return self._jobs.get((export_format, self.data_manager.version()))
+    
+    def start(self, export_format):
+        version = self.data_manager.version()
+        with self._lock:
+            job = self._jobs.get((export_format, version))
+            if job is not None and job.error is None:
+                return job
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="registry-export")
+            job = ExportJob(
+                export_format,
+                version,
+                self.artifact_path(export_format, version),
+                self.data_manager.summary()['families']
+            )
+            self._jobs[(export_format, version)] = job
+            job.future = self._pool.submit(self._build, job)
+        return job
+    
+    @instrumented
+    def _build(self, job):
+        tmp_path = job.path.with_name(job.path.name + '.tmp')
+        try:
+            self.directory.mkdir(exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                self.data_manager.write_export(job.export_format, f, EXPORT_PROGRESS_ROWS, progress=job.advance)
+            with self._lock:
+                # The export reads whatever storage holds while it runs, so a write during the build
+                # leaves a file that matches no version; the next request builds it again
+                if self.data_manager.version() != job.version:
+                    tmp_path.unlink(missing_ok=True)
+                else:
+                    os.replace(tmp_path, job.path)
+                    # Checked under the lock, so every other artifact of this format is for a version
+                    # that is no longer current
+                    for stale in self.directory.glob(f"*{job.path.suffix}"):
+                        if stale != job.path:
+                            stale.unlink(missing_ok=True)
+        except Exception as e:
+            job.error = str(e)
+            tmp_path.unlink(missing_ok=True)
+        with self._lock:
+            if job.error is None:
+                self._jobs.pop((job.export_format, job.version), None)
+
+COMPACT_GARBAGE_RATIO = 0.1
+COMPACT_MIN_GARBAGE = 100
+
+WRITE_BATCH_SIZE = 256
+WRITE_BATCH_DELAY = 0.005
+WRITE_RETRY_DELAY = 1.0
+
+def new_family(family_data):
+    family_data['التاريخ'] = datetime.now().strftime("%Y-%m-%d %H:%M")
+    family_data[RECORD_ID_COLUMN] = new_record_id()
+    return family_data
+
+def journal_paths(filepath):
+    prefix = filepath.name + '.journal'
+    try:
+        return sorted(path for path in filepath.parent.iterdir() if path.name.startswith(prefix))
+    except FileNotFoundError:
+        return []
+
+def read_journal(f):
+    entries = []
+    for line in f.read().splitlines():
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            continue
+    return entries
+
+class WriteQueue:
+    # Submissions are acknowledged once they are fsynced to the journal; a writer thread then
+    # group-commits them to storage. Each queue writes its own journal and holds a lock on it for
+    # as long as the process lives, so a journal nobody holds was left by a crash and every new
+    # DataManager replays it, skipping ids already stored.
+    def __init__(self, data_manager, batch_size=WRITE_BATCH_SIZE, batch_delay=WRITE_BATCH_DELAY):
+        self.data_manager = data_manager
+        self.journal_path = data_manager.filepath.with_name(f"{data_manager.filepath.name}.journal-{new_record_id()}")
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self._pending = []
+        self._committing = 0
+        self._condition = threading.Condition()
+        self._thread = None
+        self.error = None
+        self._journal = open(self.journal_path, 'ab')
+        if not try_lock(self._journal):
+            raise RuntimeError(f"could not lock {self.journal_path}")
+    
+    @instrumented
+    def submit(self, record):
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        with self._condition:
+            self._journal.write(line)
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            metrics.count('bytes_serialized', len(line), 'journal')
+            self._pending.append(record)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="registry-writer", daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+        return True
+    
+    def flush(self, timeout=None):
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._pending and not self._committing, timeout)
+    
+    def status(self):
+        with self._condition:
+            return {'pending_writes': len(self._pending) + self._committing, 'write_error': self.error}
+    
+    def _failed(self, message):
+        # The writer thread has no page to show errors on, so they are logged and kept for status()
+        self.error = message
+        report_error(message)
+    
+    def _run(self):
+        retrying = False
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending)
+                deadline = time.monotonic() + self.batch_delay
+                while len(self._pending) < self.batch_size and time.monotonic() < deadline:
+                    self._condition.wait(deadline - time.monotonic())
+                batch = self._pending[:self.batch_size]
+                del self._pending[:len(batch)]
+                self._committing = len(batch)
+            
+            try:
+                # A failed commit may have reached storage before the stats file, so retries skip stored ids
+                committed = self.data_manager._insert_families(
+                    self.data_manager._unstored(batch) if retrying else batch, self._failed)
+            except Exception as e:
+                self._failed(f"خطأ في حفظ البيانات: {str(e)}")
+                committed = False
+            retrying = not committed
+            with self._condition:
+                self._committing = 0
+                if not committed:
+                    self._pending[:0] = batch
+                else:
+                    self.error = None
+                    if not self._pending:
+                        self._journal.truncate(0)
+                self._condition.notify_all()
+            if not committed:
+                time.sleep(WRITE_RETRY_DELAY)
+
+def record_dict(row):
+    record = {}
+    for column in STORED_COLUMNS:
+        value = row.get(column)
+        if isinstance(value, pd.Timestamp):
+            value = value.strftime("%Y-%m-%d %H:%M")
+        elif isinstance(value, np.generic):
+            value = value.item()
+        record[column] = None if pd.isna(value) else value
+    return record
+
+def report_error(message):
+    print(message, file=sys.stderr)
+
+class DataManager:
+    def __init__(self, filename=None, backend='csv', cache_size=32, on_error=report_error,
+                 write_batch_size=WRITE_BATCH_SIZE, **storage_options):
+        storage_class = STORAGE_BACKENDS[backend]
+        self.backend = backend
+        self.on_error = on_error
+        self.write_batch_size = write_batch_size
+        self.storage = storage_class(filename or storage_class.default_filename, **storage_options)
+        self.filepath = self.storage.filepath
+        self.filename = str(self.filepath)
+        self.aggregate_store = AggregateStore(self.filepath.with_name(self.filepath.name + '.stats.json'))
+        self.cache_size = cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._cache = OrderedDict()
+        self._cache_version = None
+        self._cache_lock = threading.Lock()
+        self._index = None
+        self._index_version = None
+        self._index_lock = threading.Lock()
+        self._compaction = None
+        self._compaction_lock = threading.Lock()
+        self._write_queue = None
+        self._write_queue_lock = threading.Lock()
+        self.exports = ExportJobs(self, self.filepath.with_name(self.filepath.name + '.exports'))
+        self.snapshots = SnapshotStore(self.filepath.with_name(self.filepath.name + '.snapshots'))
+        self._snapshot_due = None
+        self._snapshot_failures = 0
+        self._snapshotting = None
+        self._snapshot_lock = threading.Lock()
+        self.storage.on_compact = self._snapshot_compaction
+        self._replay_journals()
+    
+    def _cached(self, key, compute):
+        version = self.storage.version()
+        with self._cache_lock:
+            if version != self._cache_version:
+                self._cache.clear()
+                self._cache_version = version
+            elif key in self._cache:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return self._cache[key]
+            self.cache_misses += 1
+        
+        result = compute()
+        with self._cache_lock:
+            if version == self._cache_version:
+                self._cache[key] = result
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return result
+    
+    def version(self):
+        return self.storage.version()
+    
+    def invalidate_cache(self):
+        with self._cache_lock:
+            self._cache.clear()
+            self._cache_version = None
+    
+    def cache_stats(self):
+        with self._cache_lock:
+            return {'hits': self.cache_hits, 'misses': self.cache_misses, 'entries': len(self._cache)}
+    
+    @instrumented
+    def load_data(self, columns=None):
+        try:
+            return self._cached(
+                ('load_data', tuple(columns or ())),
+                lambda: self._load_frame(columns)
+            )
+        except Exception as e:
+            self.on_error(f"خطأ في تحميل البيانات: {str(e)}")
+            return create_empty_dataframe(columns)
+    
+    @instrumented
+    def save_data(self, df):
+        try:
+            with file_lock(self.aggregate_store.lock_path):
+                self.storage.save(df)
+                self.aggregate_store.save(build_aggregates(df), self.storage.version())
+            return True
+        except Exception as e:
+            self.on_error(f"خطأ في حفظ البيانات: {str(e)}")
+            return False
+        finally:
+            self.invalidate_cache()
+    
+    @instrumented
+    def add_family(self, family_data):
+        return self._insert_families([new_family(family_data)])
+    
+    @instrumented
+    def submit_family(self, family_data):
+        try:
+            with self._write_queue_lock:
+                if self._write_queue is None:
+                    self._write_queue = WriteQueue(self, self.write_batch_size)
+            return self._write_queue.submit(new_family(family_data))
+        except Exception as e:
+            self.on_error(f"خطأ في حفظ البيانات: {str(e)}")
+            return False
+    
+    def flush_writes(self, timeout=None):
+        return self._write_queue is None or self._write_queue.flush(timeout)
+    
+    def write_status(self):
+        if self._write_queue is None:
+            return {'pending_writes': 0, 'write_error': None}
+        return self._write_queue.status()
+    
+    def _replay_journals(self):
+        # Families acknowledged to a writer that crashed are stored before this process reads anything
+        for path in journal_paths(self.filepath):
+            try:
+                with open(path, 'rb') as f:
+                    if not try_lock(f):
+                        continue
+                    missing = self._unstored(read_journal(f))
+                    if missing and not self._insert_families(missing):
+                        continue
+                    path.unlink()
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                self.on_error(f"خطأ في استعادة البيانات المعلقة: {str(e)}")
+    
+    def _unstored(self, records):
+        if not records:
+            return records
+        stored = set(self.storage.load(columns=[RECORD_ID_COLUMN])[RECORD_ID_COLUMN])
+        return [record for record in records if record[RECORD_ID_COLUMN] not in stored]
+    
+    def _insert_families(self, records, on_error=None):
+        for record in records:
+            record[NEEDS_MASK_COLUMN] = encode_needs(split_needs(record['الاحتياجات_العاجلة']))
+        stored = False
+        try:
+            with file_lock(self.aggregate_store.lock_path):
+                tail = self._synced_tail()
+                previous_version = self.storage.version()
+                self.storage.append_batch(records)
+                stored = True
+                if tail is None:
+                    self._rebuild_aggregates()
+                else:
+                    self.aggregate_store.append(tail, records, [], self.storage.version())
+                self._add_to_index(records, previous_version)
+            self._snapshot_if_due()
+            return True
+        except Exception as e:
+            if stored:
+                report_error(f"خطأ في تحديث الإحصائيات: {str(e)}")
+                return True
+            (on_error or self.on_error)(f"خطأ في حفظ البيانات: {str(e)}")
+            return False
+        finally:
+            self.invalidate_cache()
+    
+    def _find_record(self, record_id):
+        with self._index_lock:
+            if self._index is not None and self._index_version == self.storage.version():
+                row = self._index.record(record_id)
+                return None if row is None else record_dict(row)
+        df = self.storage.get(record_id)
+        return None if df.empty else record_dict(df.iloc[-1])
+    
+    @instrumented
+    def get_family(self, record_id):
+        try:
+            return self._find_record(record_id)
+        except Exception as e:
+            self.on_error(f"خطأ في تحميل البيانات: {str(e)}")
+            return None
+    
+    @instrumented
+    def update_family(self, record_id, family_data):
+        return self._edit_family(record_id, family_data)
+    
+    @instrumented
+    def delete_family(self, record_id):
+        return self._edit_family(record_id, None)
+    
+    def _edit_family(self, record_id, family_data):
+        stored = False
+        try:
+            with file_lock(self.aggregate_store.lock_path):
+                current = self._find_record(record_id)
+                if current is None:
+                    self.on_error("لم يتم العثور على العائلة المطلوبة، ربما تم حذفها أو تعديلها")
+                    return False
+                record = None
+                if family_data is not None:
+                    record = {**current, **family_data, RECORD_ID_COLUMN: record_id, 'التاريخ': current['التاريخ']}
+                    record[NEEDS_MASK_COLUMN] = encode_needs(split_needs(record['الاحتياجات_العاجلة']))
+                
+                tail = self._synced_tail()
+                previous_version = self.storage.version()
+                if record is None:
+                    self.storage.delete(record_id)
+                else:
+                    self.storage.update(record)
+                stored = True
+                if tail is None:
+                    aggregates = self._rebuild_aggregates()
+                else:
+                    aggregates = self.aggregate_store.append(
+                        tail, [record] if record is not None else [], [current], self.storage.version())
+                self._update_index(previous_version, record_id, record)
+            
+            if self.storage.garbage() >= max(COMPACT_MIN_GARBAGE, COMPACT_GARBAGE_RATIO * aggregates['families']):
+                self.compact_in_background()
+            self._snapshot_if_due()
+            return True
+        except Exception as e:
+            if stored:
+                # The edit is committed, and aggregates or an index left behind the storage version
+                # are rebuilt on their next use, so this is not a failed save
+                report_error(f"خطأ في تحديث الإحصائيات: {str(e)}")
+                return True
+            self.on_error(f"خطأ في حفظ البيانات: {str(e)}")
+            return False
+        finally:
+            self.invalidate_cache()
+    
+    def compact_in_background(self):
+        with self._compaction_lock:
+            if self._compaction is None or not self._compaction.is_alive():
+                self._compaction = threading.Thread(
+                    target=self.compact, args=(report_error,), name="registry-compaction", daemon=True)
+                self._compaction.start()
+            return self._compaction
+    
+    @instrumented
+    def import_families(self, f, name, chunk_rows=IMPORT_CHUNK_ROWS):
+        try:
+            accepted, rejected = validate_import(f, name, chunk_rows)
+            if len(accepted):
+                self._append_families(accepted)
+                self._snapshot_if_due()
+            return len(accepted), rejected
+        except Exception as e:
+            self.on_error(f"خطأ في استيراد البيانات: {str(e)}")
+            return 0, None
+        finally:
+            self.invalidate_cache()
+    
+    def _append_families(self, df):
+        with file_lock(self.aggregate_store.lock_path):
+            aggregates = self._synced_aggregates()
+            self.storage.append_many(df)
+            if aggregates is None:
+                self._rebuild_aggregates()
+            else:
+                merge_aggregates(aggregates, build_aggregates(df))
+                self.aggregate_store.save(aggregates, self.storage.version())
+    
+    @instrumented
+    def compact(self, on_error=None):
+        try:
+            with file_lock(self.aggregate_store.lock_path):
+                tail = self._synced_tail()
+                self.storage.compact()
+                if tail is None:
+                    self._rebuild_aggregates()
+                else:
+                    self.aggregate_store.append(tail, [], [], self.storage.version())
+            return True
+        except Exception as e:
+            (on_error or self.on_error)(f"خطأ في حفظ البيانات: {str(e)}")
+            return False
+        finally:
+            self.invalidate_cache()
+    
+    @instrumented
+    def aggregates(self):
+        try:
+            return self._cached(('aggregates',), self._load_aggregates)
+        except Exception as e:
+            self.on_error(f"خطأ في تحميل البيانات: {str(e)}")
+            return empty_aggregates()
+    
+    def _load_aggregates(self):
+        aggregates = self._synced_aggregates()
+        if aggregates is None:
+            with file_lock(self.aggregate_store.lock_path):
+                aggregates = self._rebuild_aggregates()
+        return aggregates
+    
+    def _synced_aggregates(self):
+        aggregates = self.aggregate_store.load()
+        if (aggregates is not None and aggregates.keys() >= empty_aggregates().keys()
+                and aggregates['data_version'] == list(self.storage.version())):
+            return aggregates
+        return None
+    
+    def _synced_tail(self):
+        tail = self.aggregate_store.tail()
+        if tail is not None and tail['data_version'] == list(self.storage.version()):
+            return tail
+        return None
+    
+    def _load_frame(self, columns=None, on_error=None):
+        # A new process reads the latest snapshot of the current base and applies the log written
+        # since it was taken, instead of parsing the registry file
+        key = self.storage.snapshot_key()
+        entry = self.snapshots.for_key(key)
+        if entry is not None:
+            read_columns = columns and list(dict.fromkeys(columns + [RECORD_ID_COLUMN]))
+            try:
+                df = self.storage.apply_segment(self.snapshots.read(entry, read_columns), columns)
+                if self.storage.snapshot_key() == key:
+                    return df
+            except Exception as e:
+                (on_error or self.on_error)(f"خطأ في قراءة النسخة الاحتياطية: {str(e)}")
+        return self.storage.load(columns)
+    
+    @instrumented
+    def snapshot(self):
+        try:
+            return self._take_snapshot(self.on_error)
+        except Exception as e:
+            self.on_error(f"خطأ في حفظ النسخة الاحتياطية: {str(e)}")
+            return None
+    
+    def _take_snapshot(self, on_error):
+        # Writers keep going while the frame is read; a frame read across a change of storage key
+        # cannot be filed under either key, so it is read again
+        for _ in range(SNAPSHOT_READ_ATTEMPTS):
+            with self.storage.snapshot_view():
+                key = self.storage.snapshot_key()
+                position = self.storage.snapshot_position()
+                entry = self.snapshots.current(key, position)
+                if entry is not None:
+                    return entry
+                df = self._load_frame(on_error=on_error)
+                unchanged = self.storage.snapshot_key() == key
+            if unchanged:
+                return self.snapshots.write(df, key, position)
+        raise RuntimeError("the registry kept changing while the snapshot was read")
+    
+    def _snapshot_compaction(self, df):
+        # Compaction holds the whole frame under the storage lock and leaves the snapshots of the
+        # previous base unusable for warm starts, so it writes the next snapshot itself
+        try:
+            self.snapshots.write(df, self.storage.snapshot_key(), self.storage.snapshot_position())
+            self._snapshot_due = datetime.now() + SNAPSHOT_INTERVAL
+        except Exception as e:
+            report_error(f"خطأ في حفظ النسخة الاحتياطية: {str(e)}")
+    
+    def snapshot_in_background(self):
+        with self._snapshot_lock:
+            if self._snapshotting is None or not self._snapshotting.is_alive():
+                self._snapshotting = threading.Thread(target=self._background_snapshot, name="registry-snapshot", daemon=True)
+                self._snapshotting.start()
+            return self._snapshotting
+    
+    def _background_snapshot(self):
+        # There is no page to show errors on from this thread, so failures are logged and retried
+        # after a delay that doubles up to the snapshot interval
+        try:
+            self._take_snapshot(report_error)
+            self._snapshot_failures = 0
+        except Exception as e:
+            self._snapshot_failures += 1
+            delay = SNAPSHOT_RETRY_DELAY * 2 ** min(self._snapshot_failures - 1, 10)
+            self._snapshot_due = datetime.now() + min(delay, SNAPSHOT_INTERVAL)
+            report_error(f"خطأ في حفظ النسخة الاحتياطية: {str(e)}")
+    
+    def _snapshot_if_due(self):
+        if self._snapshot_due is None:
+            latest = self.snapshots.latest()
+            self._snapshot_due = datetime.min if latest is None else datetime.fromisoformat(latest['created']) + SNAPSHOT_INTERVAL
+        if datetime.now() >= self._snapshot_due:
+            self._snapshot_due = datetime.now() + SNAPSHOT_INTERVAL
+            self.snapshot_in_background()
+    
+    @instrumented
+    def restore_snapshot(self, name=None):
+        try:
+            entry = self.snapshots.find(name)
+            if entry is None:
+                raise FileNotFoundError(f"no snapshot named {name}" if name else "no snapshots taken yet")
+            df = self.snapshots.read(entry)
+            with file_lock(self.aggregate_store.lock_path):
+                self.storage.save(df)
+                self.aggregate_store.save(build_aggregates(df), self.storage.version())
+                self.snapshots.retag(entry, self.storage.snapshot_key(), self.storage.snapshot_position())
+            return True
+        except Exception as e:
+            self.on_error(f"خطأ في استعادة النسخة الاحتياطية: {str(e)}")
+            return False
+        finally:
+            self.invalidate_cache()
+    
+    def _rebuild_aggregates(self):
+        aggregates = build_aggregates(self._load_frame(AGGREGATE_COLUMNS))
+        self.aggregate_store.save(aggregates, self.storage.version())
+        return aggregates
+    
+    @instrumented
+    def verify_aggregates(self):
+        with file_lock(self.aggregate_store.lock_path):
+            stored = comparable_aggregates(self.aggregate_store.load() or empty_aggregates())
+            rebuilt = comparable_aggregates(build_aggregates(self.storage.load(columns=AGGREGATE_COLUMNS)))
+        return {
+            key: {'stored': stored.get(key), 'rebuilt': value}
+            for key, value in rebuilt.items()
+            if stored.get(key) != value
+        }
+    
+    def summary(self):
+        return {**summarize(self.aggregates()), **self.write_status()}
+    
+    @instrumented
+    def _search_index(self):
+        version = self.storage.version()
+        if self._index is None or self._index_version != version:
+            self._index = RegistryIndex(self._load_frame())
+            self._index_version = version
+        return self._index
+    
+    def _add_to_index(self, records, previous_version):
+        with self._index_lock:
+            if self._index is not None and self._index_version == previous_version:
+                self._index.add_many(records)
+                self._index_version = self.storage.version()
+    
+    def _update_index(self, previous_version, record_id, record=None):
+        with self._index_lock:
+            if self._index is not None and self._index_version == previous_version:
+                self._index.remove(record_id)
+                if record is not None:
+                    self._index.add(record)
+                self._index_version = self.storage.version()
+    
+    @instrumented
+    def search_families(self, filters, offset=0, limit=None, columns=COLUMNS):
+        try:
+            with self._index_lock:
+                index = self._search_index()
+                positions = index.search(**filters)
+                if limit is not None:
+                    positions = positions[offset:offset + limit]
+                return index.df.iloc[positions][columns]
+        except Exception as e:
+            self.on_error(f"خطأ في تحميل البيانات: {str(e)}")
+            return create_empty_dataframe(columns)
+    
+    @instrumented
+    def count_search(self, filters):
+        try:
+            with self._index_lock:
+                return len(self._search_index().search(**filters))
+        except Exception as e:
+            self.on_error(f"خطأ في تحميل البيانات: {str(e)}")
+            return 0
+    
+    @instrumented
+    def find_duplicates(self, family_data):
+        try:
+            with self._index_lock:
+                index = self._search_index()
+                matches = index.duplicates.candidates(family_data)
+                df = index.df.iloc[list(matches)][COLUMNS].assign(**{'درجة_التشابه': list(matches.values())})
+            return to_storage_frame(df.sort_values('درجة_التشابه', ascending=False))
+        except Exception as e:
+            self.on_error(f"خطأ في تحميل البيانات: {str(e)}")
+            return create_empty_dataframe(COLUMNS)
+    
+    @instrumented
+    def deduplicate(self, min_score=1.0, dry_run=True):
+        try:
+            with file_lock(self.aggregate_store.lock_path):
+                df = self.storage.load().reset_index(drop=True)
+                pairs = DuplicateIndex(df).duplicate_pairs()
+                pairs = pairs[pairs['score'] >= min_score]
+                removable = removable_pairs(df, pairs)
+                kept_rows = duplicate_rows(pairs[removable])
+                # The other pairs are only reported, for someone to compare by hand
+                review_rows = {
+                    second: first
+                    for first, second in zip(pairs['first'][~removable].tolist(), pairs['second'][~removable].tolist())
+                    if second not in kept_rows
+                }
+                matched = {**review_rows, **kept_rows}
+                rows = sorted(matched)
+                report = df.iloc[rows][COLUMNS].assign(**{
+                    'مكرر_من': df['اسم_العائلة'].iloc[[matched[row] for row in rows]].to_numpy(),
+                    'حذف_تلقائي': [row in kept_rows for row in rows]
+                })
+                if kept_rows and not dry_run:
+                    kept = df.drop(index=list(kept_rows))
+                    self.storage.save(kept)
+                    self.aggregate_store.save(build_aggregates(kept), self.storage.version())
+            return to_storage_frame(report)
+        except Exception as e:
+            self.on_error(f"خطأ في حفظ البيانات: {str(e)}")
+            return None
+        finally:
+            self.invalidate_cache()
+    
+    @instrumented
+    def distinct_values(self, column):
+        try:
+            return self._cached(('distinct', column), lambda: self.storage.distinct(column))
+        except Exception as e:
+            self.on_error(f"خطأ في تحميل البيانات: {str(e)}")
+            return []
+    
+    @instrumented
+    def query_families(self, columns=None, location=None, needs=None, sort_by=None, offset=0, limit=None):
+        if limit is not None and not self.storage.paging_pushdown:
+            return self.query_families(columns, location, needs, sort_by).iloc[offset:offset + limit]
+        try:
+            return self._cached(
+                ('query', tuple(columns or ()), location, tuple(needs or ()), sort_by, offset, limit),
+                lambda: self.storage.query(
+                    columns=columns,
+                    location=location,
+                    needs=needs,
+                    sort_by=sort_by,
+                    offset=offset,
+                    limit=limit
+                )
+            )
+        except Exception as e:
+            self.on_error(f"خطأ في تحميل البيانات: {str(e)}")
+            return create_empty_dataframe(columns)
+    
+    @instrumented
+    def count_families(self, location=None, needs=None):
+        try:
+            return self._cached(
+                ('count', location, tuple(needs or ())),
+                lambda: self.storage.count(location=location, needs=needs)
+            )
+        except Exception as e:
+            self.on_error(f"خطأ في تحميل البيانات: {str(e)}")
+            return 0
+    
+    @instrumented
+    def write_export(self, export_format, f, chunk_rows=EXPORT_CHUNK_ROWS, progress=None):
+        start = f.tell() if metrics.enabled and f.seekable() else None
+        chunks = self.storage.iter_chunks(COLUMNS, chunk_rows)
+        EXPORT_FORMATS[export_format]['writer'](chunks if progress is None else reported_chunks(chunks, progress), f)
+        if start is not None:
+            metrics.count('bytes_serialized', f.tell() - start, 'export')
+
+REGION_SHARDS = {
+    "شمال غزة": 'north-gaza',
+    "غزة": 'gaza',
+    "الوسطى (دير البلح)": 'middle',
+    "خان يونس": 'khan-younis',
+    "رفح": 'rafah',
+    "نازح خارج القطاع": 'displaced'
+}
+OTHER_SHARD = 'other'
+
+def region_shard(location):
+    return REGION_SHARDS.get(location, OTHER_SHARD)
+
+def shard_path(filepath, shard):
+    return filepath.with_name(f"{filepath.stem}.{shard}{filepath.suffix}")
+
+def concat_frames(frames):
+    frames = [df for df in frames if len(df)] or frames[:1]
+    for column in CATEGORY_COLUMNS:
+        if column in frames[0].columns:
+            categories = set().union(*(to_category(df[column], []).cat.categories for df in frames))
+            frames = [df.assign(**{column: to_category(df[column], categories)}) for df in frames]
+    return pd.concat(align_dates(frames), ignore_index=True)
+
+class ShardedDataManager:
+    # One DataManager per region, each with its own file, aggregates and locks, so a region-scoped
+    # read only touches its shard and writers in different regions never wait on each other.
+    def __init__(self, filename=None, backend='csv', cache_size=32, on_error=report_error, **storage_options):
+        storage_class = STORAGE_BACKENDS[backend]
+        self.backend = backend
+        self.on_error = on_error
+        self.filepath = Path(filename or storage_class.default_filename)
+        self.filename = str(self.filepath)
+        self.shards = {
+            shard: DataManager(shard_path(self.filepath, shard), backend, cache_size, on_error, **storage_options)
+            for shard in [*REGION_SHARDS.values(), OTHER_SHARD]
+        }
+        self._merged = {}
+        self._merged_lock = threading.Lock()
+        self.exports = ExportJobs(self, self.filepath.with_name(self.filepath.name + '.exports'))
+    
+    def shard(self, location):
+        return self.shards[region_shard(location)]
+    
+    def _shards_for(self, locations=None):
+        if not locations:
+            return list(self.shards.values())
+        return [self.shards[shard] for shard in dict.fromkeys(region_shard(location) for location in locations)]
+    
+    def _split(self, df):
+        shards = df['الموقع_الجغرافي'].astype(object).map(region_shard)
+        for shard, data_manager in self.shards.items():
+            yield data_manager, df[(shards == shard).to_numpy()]
+    
+    def version(self):
+        return tuple(shard.version() for shard in self.shards.values())
+    
+    def invalidate_cache(self):
+        for shard in self.shards.values():
+            shard.invalidate_cache()
+        with self._merged_lock:
+            self._merged.clear()
+    
+    def cache_stats(self):
+        stats = [shard.cache_stats() for shard in self.shards.values()]
+        return {key: sum(shard_stats[key] for shard_stats in stats) for key in ['hits', 'misses', 'entries']}
+    
+    def load_data(self, columns=None):
+        return concat_frames([shard.load_data(columns) for shard in self.shards.values()])
+    
+    def save_data(self, df):
+        return all([shard.save_data(shard_df) for shard, shard_df in self._split(df)])
+    
+    def add_family(self, family_data):
+        return self.shard(family_data['الموقع_الجغرافي']).add_family(family_data)
+    
+    def submit_family(self, family_data):
+        return self.shard(family_data['الموقع_الجغرافي']).submit_family(family_data)
+    
+    def flush_writes(self, timeout=None):
+        return all([shard.flush_writes(timeout) for shard in self.shards.values()])
+    
+    def write_status(self):
+        statuses = [shard.write_status() for shard in self.shards.values()]
+        return {
+            'pending_writes': sum(status['pending_writes'] for status in statuses),
+            'write_error': next((status['write_error'] for status in statuses if status['write_error']), None)
+        }
+    
+    def _find_record(self, record_id):
+        for shard in self.shards.values():
+            record = shard._find_record(record_id)
+            if record is not None:
+                return shard, record
+        return None, None
+    
+    def get_family(self, record_id):
+        try:
+            return self._find_record(record_id)[1]
+        except Exception as e:
+            self.on_error(f"خطأ في تحميل البيانات: {str(e)}")
+            return None
+    
+    def update_family(self, record_id, family_data):
+        try:
+            shard, current = self._find_record(record_id)
+        except Exception as e:
+            self.on_error(f"خطأ في تحميل البيانات: {str(e)}")
+            return False
+        if current is None:
+            self.on_error("لم يتم العثور على العائلة المطلوبة، ربما تم حذفها أو تعديلها")
+            return False
+        target = self.shard(family_data.get('الموقع_الجغرافي', current['الموقع_الجغرافي']))
+        if target is shard:
+            return shard.update_family(record_id, family_data)
+        # Moving to another region writes the new shard first, so a crash in between leaves
+        # a duplicate for dedupe to find rather than losing the family.
+        record = {**current, **family_data, RECORD_ID_COLUMN: record_id, 'التاريخ': current['التاريخ']}
+        return target._insert_families([record]) and shard.delete_family(record_id)
+    
+    def delete_family(self, record_id):
+        try:
+            shard = self._find_record(record_id)[0]
+        except Exception as e:
+            self.on_error(f"خطأ في تحميل البيانات: {str(e)}")
+            return False
+        if shard is None:
+            self.on_error("لم يتم العثور على العائلة المطلوبة، ربما تم حذفها أو تعديلها")
+            return False
+        return shard.delete_family(record_id)
+    
+    def import_families(self, f, name, chunk_rows=IMPORT_CHUNK_ROWS):
+        try:
+            accepted, rejected = validate_import(f, name, chunk_rows)
+            for shard, shard_df in self._split(accepted):
+                if len(shard_df):
+                    shard._append_families(shard_df)
+            return len(accepted), rejected
+        except Exception as e:
+            self.on_error(f"خطأ في استيراد البيانات: {str(e)}")
+            return 0, None
+        finally:
+            self.invalidate_cache()
+    
+    def compact(self):
+        return all([shard.compact() for shard in self.shards.values()])
+    
+    def snapshot(self):
+        entries = [shard.snapshot() for shard in self.shards.values()]
+        return None if None in entries else entries
+    
+    def restore_snapshot(self, name=None):
+        if name is not None:
+            raise ValueError("sharded registries restore every shard from its latest snapshot")
+        return all([shard.restore_snapshot() for shard in self.shards.values()])
+    
+    def aggregates(self, locations=None):
+        shards = self._shards_for(locations)
+        key = tuple(shard.filename for shard in shards)
+        versions = [shard.version() for shard in shards]
+        with self._merged_lock:
+            if key in self._merged and self._merged[key][0] == versions:
+                return self._merged[key][1]
+        aggregates = empty_aggregates()
+        for shard in shards:
+            merge_aggregates(aggregates, shard.aggregates())
+        with self._merged_lock:
+            self._merged[key] = (versions, aggregates)
+        return aggregates
+    
+    def verify_aggregates(self):
+        return {
+            f"{name}.{key}": mismatch
+            for name, shard in self.shards.items()
+            for key, mismatch in shard.verify_aggregates().items()
+        }
+    
+    def summary(self):
+        return {**summarize(self.aggregates()), **self.write_status()}
+    
+    def search_families(self, filters, offset=0, limit=None, columns=COLUMNS):
+        shards = self._shards_for(filters.get('locations'))
+        if limit is None:
+            return concat_frames([shard.search_families(filters, columns=columns) for shard in shards])
+        pages = [create_empty_dataframe(columns)]
+        for shard in shards:
+            if limit <= 0:
+                break
+            count = shard.count_search(filters)
+            if offset >= count:
+                offset -= count
+                continue
+            pages.append(shard.search_families(filters, offset, limit, columns))
+            limit -= len(pages[-1])
+            offset = 0
+        return concat_frames(pages)
+    
+    def count_search(self, filters):
+        return sum(shard.count_search(filters) for shard in self._shards_for(filters.get('locations')))
+    
+    def find_duplicates(self, family_data):
+        # Name matches only come from the family's own region, but contact matches can be anywhere.
+        df = concat_frames([shard.find_duplicates(family_data) for shard in self.shards.values()])
+        return df.sort_values('درجة_التشابه', ascending=False, kind='stable') if len(df) else df
+    
+    def deduplicate(self, min_score=1.0, dry_run=True):
+        reports = [shard.deduplicate(min_score, dry_run) for shard in self.shards.values()]
+        if any(report is None for report in reports):
+            return None
+        return concat_frames(reports)
+    
+    def distinct_values(self, column):
+        return list(dict.fromkeys(
+            value for shard in self.shards.values() for value in shard.distinct_values(column)
+        ))
+    
+    def query_families(self, columns=None, location=None, needs=None, sort_by=None, offset=0, limit=None):
+        shards = self._shards_for(None if location is None else [location])
+        if len(shards) == 1:
+            return shards[0].query_families(columns, location, needs, sort_by, offset, limit)
+        
+        columns = columns or STORED_COLUMNS
+        fetched = columns if sort_by is None or sort_by in columns else [*columns, sort_by]
+        window = None if limit is None else offset + limit
+        df = concat_frames([shard.query_families(fetched, location, needs, sort_by, 0, window) for shard in shards])
+        if sort_by is not None:
+            df = df.sort_values(by=sort_by, ascending=False, kind='stable')
+        if limit is not None:
+            df = df.iloc[offset:offset + limit]
+        return df[columns]
+    
+    def count_families(self, location=None, needs=None):
+        shards = self._shards_for(None if location is None else [location])
+        return sum(shard.count_families(location, needs) for shard in shards)
+    
+    def write_export(self, export_format, f, chunk_rows=EXPORT_CHUNK_ROWS, progress=None):
+        chunks = itertools.chain.from_iterable(
+            shard.storage.iter_chunks(COLUMNS, chunk_rows) for shard in self.shards.values()
+        )
+        EXPORT_FORMATS[export_format]['writer'](chunks if progress is None else reported_chunks(chunks, progress), f)